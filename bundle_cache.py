@@ -0,0 +1,135 @@
+# bundle_cache.py (作成済みのケースバンドル (zip) をローカルディスクにキャッシュする)
+#
+# キーは CaseId とマニフェストのチェックサム (+ ログの期間指定) で、
+# ケースのオブジェクトが変わるとマニフェストが変わるため、古いバンドルは自動的に使われなくなる
+# (新しいバンドルを作成した時点で、同じケースのマニフェストが古いファイルは削除する。
+#  期間指定だけが違うバンドルは残す)。
+# 合計サイズが BUNDLE_CACHE_MAX_BYTES を超えたら、最終利用日時 (mtime) の古いものから削除する。
+
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+
+from config import BUNDLE_CACHE_DIR, BUNDLE_CACHE_MAX_BYTES
+from case_bundle import write_zip
+
+
+class BundleCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._locks = {}
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def checksum(manifest: dict, *variant) -> str:
+        """
+        "{マニフェストのチェックサム}_{期間指定などの違いのチェックサム}" を返す。
+        前半が同じで後半だけ違うバンドルは、同じケースの内容を別の条件でまとめたもの。
+        """
+        return f"{_digest(manifest)}_{_digest([str(v) for v in variant])}"
+
+    def _path(self, case_id: str, checksum: str) -> str:
+        return os.path.join(self.directory, f"{case_id}_{checksum}.zip")
+
+    def open(self, case_id: str, checksum: str):
+        """キャッシュ済みならファイルを開いて返し、最終利用日時を更新する。無ければ None。"""
+        path = self._path(case_id, checksum)
+        try:
+            fileobj = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return fileobj
+
+    async def get_or_build(self, case_id: str, checksum: str, refs: list, extra_files: list = ()):
+        """キャッシュ済みのバンドルを開いて返す。無ければ write_zip() で作成してから返す。"""
+        key = (case_id, checksum)
+        # ロックは待っている呼び出しが無くなるまで残し、同じバンドルを同時に 2 つ作らないようにする
+        lock, users = self._locks.get(key, (None, 0))
+        lock = lock or asyncio.Lock()
+        self._locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                fileobj = self.open(case_id, checksum)
+                if fileobj:
+                    return fileobj
+                path = self._path(case_id, checksum)
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f"{case_id}_", suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "wb") as tmp:
+                        await write_zip(tmp, refs, extra_files)
+                    os.replace(tmp_path, path)
+                except BaseException:
+                    _remove(tmp_path)
+                    raise
+                fileobj = open(path, "rb")
+        finally:
+            lock, users = self._locks[key]
+            if users > 1:
+                self._locks[key] = (lock, users - 1)
+            else:
+                del self._locks[key]
+        await asyncio.to_thread(self._cleanup, case_id, path)
+        return fileobj
+
+    def _cleanup(self, case_id: str, keep_path: str):
+        """
+        同じケースでマニフェストが古くなったバンドルを削除し、
+        合計サイズが上限に収まるまで古いものから削除する。
+        """
+        _, manifest_checksum, _ = _split_name(os.path.basename(keep_path))
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".zip"):
+                continue
+            entry_case_id, entry_checksum, _ = _split_name(entry.name)
+            if entry_case_id == case_id and entry_checksum != manifest_checksum:
+                _remove(entry.path)
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep_path:
+                continue
+            _remove(path)
+            total -= size
+
+
+def _digest(value) -> str:
+    data = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
+
+
+def _split_name(name: str) -> tuple:
+    """"{CaseId}_{マニフェスト}_{条件}.zip" を (CaseId, マニフェストのチェックサム, 条件のチェックサム) に分ける"""
+    parts = name[:-len(".zip")].rsplit("_", 2)
+    return tuple(parts) if len(parts) == 3 else (None, None, None)
+
+
+def _remove(path: str):
+    # 開いているファイルは削除後も読み込めるため、送信中のバンドルが消えても問題ない
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+_cache = None
+
+
+def get_bundle_cache() -> BundleCache:
+    global _cache
+    if _cache is None:
+        _cache = BundleCache(BUNDLE_CACHE_DIR, BUNDLE_CACHE_MAX_BYTES)
+    return _cache
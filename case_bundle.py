@@ -0,0 +1,193 @@
+# case_bundle.py (訴訟ホールド用にケースのオブジェクトを取得し、zip にまとめる)
+#
+# オブジェクトは並列 (最大 BUNDLE_FETCH_CONCURRENCY 件) で取得し、それぞれ一時ファイルに受ける。
+# zip は書き出し先のファイルへ 1 エントリずつ追記するため、全オブジェクトを同時にメモリへ載せない。
+# 書き出し先には open_spool() (BUNDLE_SPOOL_MAX_MEMORY を超えるとディスクへ退避) などを渡す。
+# Discord に添付できない大きさのバンドルは upload_zip() でバケットへ直接ストリーミングし、
+# 期限付き URL で共有する (Bot から Discord へ大きなファイルを送らない)。
+
+import asyncio
+import datetime
+import os
+import shutil
+import tempfile
+import zipfile
+
+from config import BUNDLE_FETCH_CONCURRENCY, BUNDLE_SPOOL_MAX_MEMORY, BUNDLE_URL_EXPIRY
+from storage import get_storage
+
+# Discord にそのまま添付できるファイルサイズの上限
+DISCORD_UPLOAD_LIMIT = 8 * 1024 * 1024
+# 取得したオブジェクト 1 件あたり、メモリに保持する上限 (超えた分は一時ファイルへ)
+OBJECT_SPOOL_MEMORY = 1024 * 1024
+# zip へコピーする単位
+COPY_CHUNK_SIZE = 64 * 1024
+# zip の出力をアップロードへ渡す単位
+UPLOAD_WRITE_SIZE = 1024 * 1024
+
+
+def open_spool() -> tempfile.SpooledTemporaryFile:
+    """バンドルの書き出し先 (BUNDLE_SPOOL_MAX_MEMORY までメモリ、それ以上はディスク)"""
+    return tempfile.SpooledTemporaryFile(max_size=BUNDLE_SPOOL_MAX_MEMORY)
+
+
+async def _download(object_key: str):
+    spool = tempfile.SpooledTemporaryFile(max_size=OBJECT_SPOOL_MEMORY)
+    try:
+        await get_storage().download_to(object_key, spool)
+        spool.seek(0)
+        return spool
+    except BaseException:
+        spool.close()
+        raise
+
+
+async def fetch_objects(refs: list) -> list:
+    """
+    refs ([(ファイル名, オブジェクトキー)]) を並列で取得し、[(ファイル名, 一時ファイル)] を同じ順で返す。
+    一時ファイルは呼び出し側で close() する。
+    """
+    semaphore = asyncio.Semaphore(BUNDLE_FETCH_CONCURRENCY)
+
+    async def fetch(object_key: str):
+        async with semaphore:
+            return await _download(object_key)
+
+    results = await asyncio.gather(*(fetch(object_key) for _, object_key in refs), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        for result in results:
+            if not isinstance(result, BaseException):
+                result.close()
+        raise errors[0]
+    return [(filename, spool) for (filename, _), spool in zip(refs, results)]
+
+
+def _copy_into_zip(zf: zipfile.ZipFile, name: str, source):
+    with zf.open(name, "w", force_zip64=True) as dest:
+        shutil.copyfileobj(source, dest, COPY_CHUNK_SIZE)
+
+
+async def write_zip(fileobj, refs: list, extra_files: list = (), on_progress=None):
+    """
+    extra_files ([(ファイル名, bytes)]) と refs ([(ファイル名, オブジェクトキー)]) を zip にして fileobj に書き出す。
+    extra_files の bytes の代わりに「bytes を返すコルーチン関数」を渡すと、そのファイルを書き込む直前に呼び出す
+    (多数のログを先にすべてメモリへ読み込まず、1 件ずつ読み込んで書き込める)。
+    取得は並列で行い、取得できたものから順に zip へ追記する (圧縮・書き込みは別スレッドで実行)。
+    fileobj はシークできないストリームでもよい。
+    on_progress(完了数, 総数) を指定すると、オブジェクトを 1 件追記するごとに呼ばれる。
+    """
+    done = 0
+    zf = zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED)
+    semaphore = asyncio.Semaphore(BUNDLE_FETCH_CONCURRENCY)
+    zip_lock = asyncio.Lock()
+
+    async def add(name: str, object_key: str):
+        nonlocal done
+        # zip への追記が終わるまで枠を保持し、同時に抱える一時ファイルを BUNDLE_FETCH_CONCURRENCY 個までに抑える
+        async with semaphore:
+            spool = await _download(object_key)
+            try:
+                async with zip_lock:
+                    await asyncio.to_thread(_copy_into_zip, zf, name, spool)
+            finally:
+                spool.close()
+        done += 1
+        if on_progress:
+            await on_progress(done, len(refs))
+
+    for name, data in extra_files:
+        if callable(data):
+            data = await data()
+        await asyncio.to_thread(zf.writestr, name, data)
+    tasks = [asyncio.create_task(add(name, object_key)) for name, object_key in refs]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # 1 件でも失敗したら残りの取得を止める (書きかけの zip は呼び出し側で破棄する)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    await asyncio.to_thread(zf.close)
+
+
+class _UploadWriter:
+    """
+    zip を書き込むスレッドから StreamingUpload へ書き込むための file-like オブジェクト。
+    シークできないストリームとして扱われ、UPLOAD_WRITE_SIZE ごとにまとめてイベントループへ渡す。
+    """
+
+    def __init__(self, upload, loop: asyncio.AbstractEventLoop):
+        self._upload = upload
+        self._loop = loop
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        if len(self._buffer) >= UPLOAD_WRITE_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            data, self._buffer = bytes(self._buffer), bytearray()
+            asyncio.run_coroutine_threadsafe(self._upload.write(data), self._loop).result()
+
+
+async def upload_zip(object_name: str, refs: list, extra_files: list = (), on_progress=None) -> int:
+    """write_zip() の出力をそのままバケットの object_name へアップロードし、アップロードしたバイト数を返す。"""
+    upload = get_storage().open_upload(object_name, content_type="application/zip")
+    writer = _UploadWriter(upload, asyncio.get_running_loop())
+    try:
+        await write_zip(writer, refs, extra_files, on_progress)
+        await asyncio.to_thread(writer.flush)
+        await upload.finish()
+    except Exception as e:
+        await upload.abort(e)
+        raise
+    return upload.bytes_written
+
+
+def _export_key(name: str) -> str:
+    return f"exports/{datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{name}"
+
+
+async def _presign(object_name: str) -> tuple:
+    expires = datetime.timedelta(seconds=BUNDLE_URL_EXPIRY)
+    url = await get_storage().presigned_get_url(object_name, expires)
+    return url, datetime.datetime.now() + expires
+
+
+async def export_bundle_url(name: str, refs: list, extra_files: list = (), on_progress=None) -> tuple:
+    """
+    バンドルを exports/ に作成し、(期限付き URL, サイズ, 有効期限) を返す。
+    有効期限は BUNDLE_URL_EXPIRY 秒。
+    """
+    object_name = _export_key(name)
+    size = await upload_zip(object_name, refs, extra_files, on_progress)
+    url, expires_at = await _presign(object_name)
+    return url, size, expires_at
+
+
+def cached_export_key(case_id: str, checksum: str) -> str:
+    """ディスクキャッシュのチェックサムから決まるバンドルのキー (同じ内容のバンドルは同じキーになる)"""
+    return f"exports/cache/{case_id}_{checksum}.zip"
+
+
+async def export_cached_url(object_name: str, open_bundle) -> tuple:
+    """
+    object_name (cached_export_key()) のバンドルがバケットに既にあれば、アップロードせずに URL だけを発行し直す。
+    無ければ open_bundle() (開いたバンドルのファイルを返すコルーチン関数) の内容をアップロードする。
+    export_bundle_url() と同じ形式で返す。
+    """
+    storage = get_storage()
+    stat = await storage.stat_if_exists(object_name)
+    if stat is not None:
+        size = stat.size
+    else:
+        with await open_bundle() as fileobj:
+            size = os.fstat(fileobj.fileno()).st_size
+            await storage.put_file(object_name, fileobj, size, content_type="application/zip")
+    url, expires_at = await _presign(object_name)
+    return url, size, expires_at
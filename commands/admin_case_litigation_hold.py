@@ -2,77 +2,99 @@ import discord
 from discord import app_commands, Interaction
 from discord.ext import commands
 from config import *
-import mysql.connector
-from minio import Minio
+from db import fetch_one, fetch_all
+from storage import get_storage
+from job_queue import get_job_queue
+from transcript import load_case_manifest, read_entries, render_transcript, LEGACY_MANIFEST_FORMAT
+from case_bundle import fetch_objects, export_bundle_url, export_cached_url, cached_export_key, DISCORD_UPLOAD_LIMIT
+from bundle_cache import get_bundle_cache
 from minio.error import S3Error
+import asyncio
+import datetime
 import io
-import zipfile
-def get_db_connection():
-    return mysql.connector.connect(
-        host=DB_HOST,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME
-    )
+import json
+import re
+import time
+
+# MinIO へのアクセスは storage.py の共有クライアント (専用スレッドで実行) を使用する
 
-# MinIO クライアントの初期化（configから取得推奨）
-minio_client = Minio(
-    MINIO_ENDPOINT, access_key=MINIO_ACCESS_KEY, secret_key=MINIO_SECRET_KEY, secure=MINIO_USE_SSL
-)
+async def read_case_log(manifest: dict, since_at: datetime.datetime = None, until_at: datetime.datetime = None) -> bytes:
+    """マニフェストからケースのログ (テキスト形式) を取得する。セグメント形式は期間に該当するセグメントのみ取得する。"""
+    if manifest["format"] == LEGACY_MANIFEST_FORMAT:
+        return await get_storage().get_bytes(manifest["log"]["key"])
+    return render_transcript(await read_entries(manifest, since_at, until_at))
+
+def manifest_attachment_refs(manifest: dict, prefix: str = "") -> tuple:
+    """
+    マニフェストの添付ファイルを [(zip 内のファイル名, オブジェクトキー)] と合計サイズにする。
+    同名ファイルは添付ID (無ければ連番) を付けて区別する。
+    """
+    refs = []
+    total_size = 0
+    used_names = set()
+    for index, att in enumerate(manifest["attachments"]):
+        if not att.get("object_key"):
+            continue  # 保存に失敗した添付ファイル
+        filename = att["filename"]
+        if filename in used_names:
+            filename = f"{att.get('id', index)}_{filename}"
+        used_names.add(filename)
+        refs.append((f"{prefix}{filename}", att["object_key"]))
+        total_size += att.get("size") or 0
+    return refs, total_size
 
 class AdminCaseLog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
     @app_commands.command(name="get_case_log", description="指定されたケースのログと添付ファイルを取得します")
-    @app_commands.describe(case_id="対象のケースID（12桁）")
+    @app_commands.describe(
+        case_id="対象のケースID（12桁）",
+        since="この日以降のログのみ取得（YYYY-MM-DD、UTC）",
+        until="この日までのログのみ取得（YYYY-MM-DD、UTC）",
+        metadata_only="ログ本文と添付ファイルを取得せず、件数・期間などの情報のみ表示"
+    )
     @app_commands.guilds(discord.Object(id=ADMIN_GUILD_ID))
-    async def get_case_log(self, interaction: Interaction, case_id: str):
+    async def get_case_log(self, interaction: Interaction, case_id: str,
+                           since: str = None, until: str = None, metadata_only: bool = False):
         # チャンネル制限チェック
         if interaction.channel.id != LEGAL_RESPONSE_CHANNEL_ID:
             await interaction.response.send_message("このコマンドは法的対応チャンネル内でのみ実行できます。", ephemeral=True)
             return
 
-        # DB から s3_filepath を取得
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM tickets WHERE CaseId = %s", (case_id,))
-        ticket = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        try:
+            since_at = datetime.datetime.strptime(since, "%Y-%m-%d") if since else None
+            until_at = datetime.datetime.strptime(until, "%Y-%m-%d") + datetime.timedelta(days=1) if until else None
+        except ValueError:
+            await interaction.response.send_message("日付は YYYY-MM-DD の形式で指定してください。", ephemeral=True)
+            return
+
+        # DB からマニフェストのキー (未設定の古いチケットは s3_filepath) を取得
+        ticket = await fetch_one("SELECT * FROM tickets WHERE CaseId = %s", (case_id,), dictionary=True)
 
         if not ticket:
             await interaction.response.send_message("該当するチケットが見つかりません。", ephemeral=True)
             return
 
-        s3_filepath = ticket.get("s3_filepath")
-        if not s3_filepath:
+        if not (ticket.get("manifest_key") or ticket.get("s3_filepath")):
             await interaction.response.send_message("ログファイルの情報がありません。", ephemeral=True)
             return
 
         await interaction.response.defer(ephemeral=True)
 
+        # マニフェストを 1 回読み、ログと添付ファイルはそこに記録されたキーだけを取得する
+        log_data = b""
         try:
-            log_obj = minio_client.get_object(MINIO_BUCKET_NAME, s3_filepath)
-            log_data = log_obj.read()
+            manifest = await load_case_manifest(ticket)
+            if not metadata_only:
+                log_data = await read_case_log(manifest, since_at, until_at)
             log_file = discord.File(io.BytesIO(log_data), filename="case_log.txt")
         except S3Error as e:
             await interaction.followup.send(f"ログファイルの取得に失敗しました: {str(e)}", ephemeral=True)
             return
 
-        # 添付ファイルをすべて収集
-        attached_files = []
-        try:
-            objects = minio_client.list_objects(MINIO_BUCKET_NAME, prefix=f"ticket_logs/{case_id}_", recursive=True)
-            for obj in objects:
-                if obj.object_name == s3_filepath:
-                    continue  # ログファイル自身は除外
-                data = minio_client.get_object(MINIO_BUCKET_NAME, obj.object_name).read()
-                filename = obj.object_name.split("/")[-1]
-                attached_files.append((filename, io.BytesIO(data)))
-        except Exception as e:
-            await interaction.followup.send(f"S3から添付ファイルを取得中にエラーが発生しました: {e}", ephemeral=True)
-            return
+        # 添付ファイルの一覧 (サイズはマニフェストに記録されているため、取得前に送信形式を決められる)
+        attachment_refs, attachments_size = manifest_attachment_refs(manifest)
 
         # 追加情報を収集
         try:
@@ -84,15 +106,10 @@ class AdminCaseLog(commands.Cog):
         except:
             assignee = None
 
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM ticket_surveys WHERE ticket_id = %s", (ticket["id"],))
-        survey = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        survey = await fetch_one("SELECT * FROM ticket_surveys WHERE ticket_id = %s", (ticket["id"],), dictionary=True)
 
-        # 添付ファイルの有無判定（s3_filepath以外があるか）
-        has_attachments = any(attached_files)
+        # 添付ファイルの有無判定
+        has_attachments = bool(attachment_refs)
 
         summary = (
             "*** 訴訟ホールド情報 ***\n"
@@ -115,27 +132,287 @@ class AdminCaseLog(commands.Cog):
             "🔸 添付ファイルの有無\n"
             f"{'あり' if has_attachments else 'なし'}"
         )
+        if manifest["format"] != LEGACY_MANIFEST_FORMAT:
+            summary += (
+                "\n\n🔸 ログ情報\n"
+                f"件数 : {manifest['entries']}\n"
+                f"期間 (UTC) : {manifest['first_at'] or 'N/A'} 〜 {manifest['last_at'] or 'N/A'}\n"
+                f"保存サイズ : {manifest['size']:,} bytes ({len(manifest['segments'])} セグメント)"
+            )
+        if since_at or until_at:
+            summary += f"\n※ログは {since or '最初'} 〜 {until or '最後'} の範囲のみ出力しています。"
+
+        if metadata_only:
+            summary += "\n\n🔸 添付ファイル一覧\n" + ("\n".join(name for name, _ in attachment_refs) or "なし")
+            await interaction.followup.send(content=summary[:2000])
+            return
 
         # Discord の送信制限に応じて送信形式を分岐
-        total_size = sum(buf.getbuffer().nbytes for _, buf in attached_files) + len(log_data)
-        if total_size < 8 * 1024 * 1024:  # Discord ファイル制限
-            files = [log_file]
-            for name, buf in attached_files:
-                buf.seek(0)
-                files.append(discord.File(buf, filename=name))
-            await interaction.followup.send(content=summary, files=files)
-        else:
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as z:
-                z.writestr("case_log.txt", log_data)
-                for name, buf in attached_files:
-                    buf.seek(0)
-                    z.writestr(name, buf.read())
-            zip_buffer.seek(0)
-            await interaction.followup.send(
-                content=summary + "\n\n※ファイルは zip 圧縮されています。",
-                file=discord.File(zip_buffer, filename=f"{case_id}_case_data.zip")
-            )
+        # (オブジェクトは並列で一時ファイルへ取得し、全体を同時にメモリへ載せない)
+        total_size = attachments_size + len(log_data)
+        try:
+            if total_size < DISCORD_UPLOAD_LIMIT:
+                attached_files = await fetch_objects(attachment_refs)
+                try:
+                    files = [log_file] + [discord.File(spool, filename=name) for name, spool in attached_files]
+                    await interaction.followup.send(content=summary, files=files)
+                finally:
+                    for _, spool in attached_files:
+                        spool.close()
+            else:
+                # Discord に添付できないため、バケット内に zip を作成して期限付き URL で共有する
+                # (キャッシュが有効なら、同じ内容のバンドルはバケットにあるものに URL を発行し直すだけで済ませ、
+                #  バケットに無い場合もディスクキャッシュがあれば再取得・再圧縮せずにアップロードする)
+                bundle_name = f"{case_id}_case_data.zip"
+                extra_files = [("case_log.txt", log_data)]
+                cache = get_bundle_cache()
+                if cache.enabled:
+                    checksum = cache.checksum(manifest, since_at, until_at)
+                    url, size, expires_at = await export_cached_url(
+                        cached_export_key(case_id, checksum),
+                        lambda: cache.get_or_build(case_id, checksum, attachment_refs, extra_files)
+                    )
+                else:
+                    url, size, expires_at = await export_bundle_url(bundle_name, attachment_refs, extra_files=extra_files)
+                await interaction.followup.send(
+                    content=summary + (
+                        f"\n\n※ファイルサイズ ({size / 1024 / 1024:.1f} MB) が Discord の上限を超えるため、"
+                        f"zip をダウンロード用 URL で共有します（{expires_at.strftime('%Y年%m月%d日 %H:%M')} まで有効）。\n{url}"
+                    )
+                )
+        except Exception as e:
+            await interaction.followup.send(f"S3から添付ファイルを取得中にエラーが発生しました: {e}", ephemeral=True)
+
+    @app_commands.command(name="bulk_case_log", description="複数ケースのログと添付ファイルを一括でエクスポートします")
+    @app_commands.describe(
+        case_ids="対象のケースID（12桁）をカンマまたは空白区切りで指定",
+        since="起票日がこの日以降のケースを対象にする（YYYY-MM-DD）",
+        until="起票日がこの日までのケースを対象にする（YYYY-MM-DD）"
+    )
+    @app_commands.guilds(discord.Object(id=ADMIN_GUILD_ID))
+    async def bulk_case_log(self, interaction: Interaction, case_ids: str = None, since: str = None, until: str = None):
+        if interaction.channel.id != LEGAL_RESPONSE_CHANNEL_ID:
+            await interaction.response.send_message("このコマンドは法的対応チャンネル内でのみ実行できます。", ephemeral=True)
+            return
+
+        ids = parse_case_ids(case_ids) if case_ids else []
+        if case_ids and not ids:
+            await interaction.response.send_message("有効なケースID（12桁）が含まれていません。", ephemeral=True)
+            return
+        if not ids and not (since and until):
+            await interaction.response.send_message("ケースID、または期間（since と until）を指定してください。", ephemeral=True)
+            return
+        if len(ids) > BULK_EXPORT_MAX_CASES:
+            await interaction.response.send_message(f"一度にエクスポートできるのは {BULK_EXPORT_MAX_CASES} 件までです。", ephemeral=True)
+            return
+        try:
+            since_at = datetime.datetime.strptime(since, "%Y-%m-%d") if since else None
+            until_at = datetime.datetime.strptime(until, "%Y-%m-%d") + datetime.timedelta(days=1) if until else None
+        except ValueError:
+            await interaction.response.send_message("日付は YYYY-MM-DD の形式で指定してください。", ephemeral=True)
+            return
+
+        await interaction.response.send_message("📦 一括エクスポートを受け付けました。進捗はこのチャンネルに表示されます。", ephemeral=True)
+        progress = await interaction.channel.send(f"📦 **一括エクスポート** (依頼者: {interaction.user.mention})\n⏳ 開始待ち…")
+        try:
+            await get_job_queue().enqueue(BULK_EXPORT_JOB, {
+                "case_ids": ids,
+                "since": since_at.isoformat() if since_at and not ids else None,
+                "until": until_at.isoformat() if until_at and not ids else None,
+                "channel_id": interaction.channel.id,
+                "message_id": progress.id,
+                "requester_id": interaction.user.id,
+            })
+        except Exception as e:
+            # 進捗メッセージが「開始待ち」のまま残らないようにする
+            await progress.edit(content=f"📦 **一括エクスポート** (依頼者: {interaction.user.mention})\n❌ 登録に失敗しました。")
+            await interaction.followup.send(f"❌ 一括エクスポートの登録に失敗しました: {e}", ephemeral=True)
+
+
+# --- 一括エクスポートのバックグラウンドジョブ ---
+BULK_EXPORT_JOB = "case_bulk_export"
+# 1 回のジョブで扱うケース数の上限と、IN 句 1 回あたりの件数
+BULK_EXPORT_MAX_CASES = 500
+BULK_QUERY_CHUNK_SIZE = 200
+# 進捗メッセージを更新する間隔 (秒)
+BULK_PROGRESS_INTERVAL = 5
+
+def parse_case_ids(text: str) -> list:
+    """文字列から 12 桁のケースIDを順序を保って重複なく取り出す"""
+    return list(dict.fromkeys(re.findall(r"\b\d{12}\b", text)))
+
+async def fetch_tickets_bulk(case_ids: list = None, since_at: datetime.datetime = None, until_at: datetime.datetime = None) -> tuple:
+    """
+    ケースIDの一覧 (IN 句でまとめて取得) または起票日の期間でチケットを取得し、(チケット, 打ち切りの有無) を返す。
+    期間指定で BULK_EXPORT_MAX_CASES 件を超える場合は、起票日の古い順に上限まで返して打ち切りありとする。
+    """
+    if not case_ids:
+        tickets = await fetch_all(
+            "SELECT * FROM tickets WHERE created_at >= %s AND created_at < %s ORDER BY created_at, id LIMIT %s",
+            (since_at, until_at, BULK_EXPORT_MAX_CASES + 1), dictionary=True
+        )
+        return tickets[:BULK_EXPORT_MAX_CASES], len(tickets) > BULK_EXPORT_MAX_CASES
+    tickets = []
+    for i in range(0, len(case_ids), BULK_QUERY_CHUNK_SIZE):
+        chunk = case_ids[i:i + BULK_QUERY_CHUNK_SIZE]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        tickets.extend(await fetch_all(f"SELECT * FROM tickets WHERE CaseId IN ({placeholders})", tuple(chunk), dictionary=True))
+    order = {case_id: i for i, case_id in enumerate(case_ids)}
+    return sorted(tickets, key=lambda ticket: order[ticket["CaseId"]]), False
+
+async def fetch_surveys_bulk(ticket_ids: list) -> dict:
+    """チケットIDごとのアンケートを IN 句でまとめて取得する"""
+    surveys = {}
+    for i in range(0, len(ticket_ids), BULK_QUERY_CHUNK_SIZE):
+        chunk = ticket_ids[i:i + BULK_QUERY_CHUNK_SIZE]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        for survey in await fetch_all(f"SELECT * FROM ticket_surveys WHERE ticket_id IN ({placeholders})", tuple(chunk), dictionary=True):
+            surveys[survey["ticket_id"]] = survey
+    return surveys
+
+async def run_bulk_export_job(bot: commands.Bot, payload: dict):
+    """
+    一括エクスポート本体: チケットとアンケートをまとめて取得し、各ケースのマニフェストを並列で読み、
+    全ケースを 1 つの zip (manifest.json 付き) としてバケットへストリーミングして期限付き URL を返す。
+    各ケースのログは zip へ書き込む直前に 1 件ずつ読み込み、全ケースのログを同時にメモリへ載せない。
+    """
+    channel = bot.get_channel(payload["channel_id"]) or await bot.fetch_channel(payload["channel_id"])
+    progress = channel.get_partial_message(payload["message_id"])
+    header = f"📦 **一括エクスポート** (依頼者: <@{payload['requester_id']}>)"
+    last_report = 0.0
+
+    async def report(text: str, force: bool = False):
+        nonlocal last_report
+        now = time.monotonic()
+        if not force and now - last_report < BULK_PROGRESS_INTERVAL:
+            return
+        last_report = now
+        try:
+            await progress.edit(content=f"{header}\n{text}"[:2000])
+        except discord.HTTPException:
+            pass
+
+    # 1. チケットとアンケートをまとめて取得
+    await report("⏳ チケット情報を取得しています…", force=True)
+    since_at = datetime.datetime.fromisoformat(payload["since"]) if payload.get("since") else None
+    until_at = datetime.datetime.fromisoformat(payload["until"]) if payload.get("until") else None
+    tickets, truncated = await fetch_tickets_bulk(payload["case_ids"], since_at, until_at)
+    missing = [case_id for case_id in payload["case_ids"] if case_id not in {ticket["CaseId"] for ticket in tickets}]
+    surveys = await fetch_surveys_bulk([ticket["id"] for ticket in tickets])
+    if not tickets:
+        await report("⚠️ 対象のチケットが見つかりませんでした。", force=True)
+        return
+
+    # 2. 各ケースのマニフェストを並列で取得 (失敗したケースは manifest.json に記録して続行)
+    semaphore = asyncio.Semaphore(BUNDLE_FETCH_CONCURRENCY)
+    loaded = 0
+
+    async def load_case(ticket: dict) -> dict:
+        nonlocal loaded
+        case_id = ticket["CaseId"]
+        survey = surveys.get(ticket["id"])
+        entry = {
+            "case_id": case_id,
+            "ticket": {key: ticket.get(key) for key in (
+                "user_id", "assigned_to", "category", "content", "status", "solution", "is_escalated", "created_at", "closed_at"
+            )},
+            "survey": {key: survey.get(key) for key in ("is_resolved", "rating", "feedback")} if survey else None,
+            "files": [],
+            "error": None,
+        }
+        async with semaphore:
+            try:
+                if ticket.get("manifest_key") or ticket.get("s3_filepath"):
+                    manifest = await load_case_manifest(ticket)
+                    entry["manifest"] = manifest
+                    entry["refs"], _ = manifest_attachment_refs(manifest, prefix=f"{case_id}/attachments/")
+                    by_key = {att.get("object_key"): att for att in manifest["attachments"]}
+                    entry["files"] = [
+                        {"name": name, "object_key": key, "size": by_key[key].get("size"), "sha256": by_key[key].get("sha256")}
+                        for name, key in entry["refs"]
+                    ]
+                else:
+                    entry["error"] = "ログファイルの情報がありません"
+            except Exception as e:
+                entry["error"] = f"{type(e).__name__}: {e}"
+        loaded += 1
+        await report(f"⏳ ケース情報を取得しています… {loaded}/{len(tickets)}")
+        return entry
+
+    cases = await asyncio.gather(*(load_case(ticket) for ticket in tickets))
+
+    # 3. 全ケースを 1 つの zip にまとめてバケットへストリーミング
+    #    ログは書き込む直前に読み込み、manifest.json はログの取得結果 (エラー) を反映するため最後に作る
+    written_logs = 0
+
+    def case_log_loader(case: dict):
+        async def load() -> bytes:
+            nonlocal written_logs
+            manifest = case.pop("manifest")
+            written_logs += 1
+            await report(f"⏳ アーカイブを作成しています… ログ {written_logs}/{len(extra_files) - 1}")
+            try:
+                return await read_case_log(manifest)
+            except Exception as e:
+                case["error"] = f"{type(e).__name__}: {e}"
+                return f"ログを取得できませんでした: {case['error']}".encode("utf-8")
+        return load
+
+    async def build_export_manifest() -> bytes:
+        export_manifest = {
+            "generated_at": datetime.datetime.utcnow().isoformat(),
+            "requested_by": payload["requester_id"],
+            "cases": [{key: value for key, value in case.items() if key not in ("manifest", "refs")} for case in cases],
+            "missing_case_ids": missing,
+            # 期間指定で上限を超えた場合は、出力した最後のケースの起票日時まで (続きは since を変えて再実行する)
+            "truncated": truncated,
+            "truncated_after": tickets[-1]["created_at"] if truncated else None,
+        }
+        return json.dumps(export_manifest, ensure_ascii=False, indent=2, default=str).encode("utf-8")
+
+    refs = [ref for case in cases for ref in case.get("refs", [])]
+    extra_files = [(f"{case['case_id']}/case_log.txt", case_log_loader(case)) for case in cases if "manifest" in case]
+    extra_files.append(("manifest.json", build_export_manifest))
+
+    async def on_progress(done: int, total: int):
+        await report(f"⏳ アーカイブを作成しています… 添付ファイル {done}/{total}")
+
+    await report(f"⏳ アーカイブを作成しています… ログ 0/{len(extra_files) - 1}", force=True)
+    url, size, expires_at = await export_bundle_url(
+        f"legal_hold_{len(cases)}cases.zip", refs, extra_files=extra_files, on_progress=on_progress
+    )
+
+    failed = [case["case_id"] for case in cases if case["error"]]
+    lines = [
+        f"✅ {len(cases)} 件のケースをエクスポートしました（{size / 1024 / 1024:.1f} MB）。",
+        f"ダウンロード URL（{expires_at.strftime('%Y年%m月%d日 %H:%M')} まで有効）:\n{url}",
+    ]
+    if truncated:
+        lines.append(
+            f"⚠️ 期間内のケースが上限 ({BULK_EXPORT_MAX_CASES} 件) を超えたため、起票日時 {tickets[-1]['created_at']} までのケースのみ出力しました。"
+            "残りは since を変えて再度実行してください。"
+        )
+    if missing:
+        lines.append(f"⚠️ 見つからなかったケース: {', '.join(missing)}")
+    if failed:
+        lines.append(f"⚠️ ログを取得できなかったケース（詳細は manifest.json）: {', '.join(failed)}")
+    await report("\n".join(lines), force=True)
+
+async def notify_bulk_export_failed(bot: commands.Bot, payload: dict, error: str):
+    channel = bot.get_channel(payload["channel_id"])
+    if channel:
+        await channel.send(f"❌ 一括エクスポートに失敗しました (依頼者: <@{payload['requester_id']}>)\n`{error}`")
 
 async def setup(bot: commands.Bot):
-    await bot.add_cog(AdminCaseLog(bot))
\ No newline at end of file
+    await bot.add_cog(AdminCaseLog(bot))
+
+    async def handle_bulk_export(payload: dict):
+        await run_bulk_export_job(bot, payload)
+
+    async def handle_bulk_export_failed(payload: dict, error: str):
+        await notify_bulk_export_failed(bot, payload, error)
+
+    # 一括エクスポートは長時間かかるため同時実行数を絞り、チケットのクローズ処理用のワーカーを常に空けておく
+    get_job_queue().register(
+        BULK_EXPORT_JOB, handle_bulk_export, on_failure=handle_bulk_export_failed, max_concurrency=BULK_EXPORT_CONCURRENCY
+    )
\ No newline at end of file
@@ -1,4 +1,5 @@
 from config import ADMIN_GUILD_ID
+from guild_index import get_guild_index
 from discord import app_commands, Interaction, TextChannel, PermissionOverwrite
 from discord.ext import commands
 from discord import ui
@@ -31,7 +32,7 @@ class ConfirmCloseView(ui.View):
         await self.channel.edit(overwrites=overwrites)
 
         # ✅ 完了カテゴリーへ移動（なければ作成）
-        archive_category = discord.utils.get(guild.categories, name="完了済みタスク")
+        archive_category = get_guild_index().category(guild, "完了済みタスク")
         if not archive_category:
             archive_category = await guild.create_category("完了済みタスク")
 
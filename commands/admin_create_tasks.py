@@ -1,4 +1,5 @@
 from config import ADMIN_GUILD_ID
+from guild_index import get_guild_index
 from discord import app_commands, Interaction, Role, TextChannel, PermissionOverwrite
 from discord.ext import commands
 from discord import ui
@@ -30,10 +31,11 @@ class TaskNameModal(ui.Modal, title="タスク名を入力してください"):
 
             async def callback(self, select_interaction: Interaction):
                 role_id = int(self.values[0])
-                role = discord.utils.get(guild.roles, id=role_id)
+                role = guild.get_role(role_id)
+                index = get_guild_index()
 
                 # チャンネル名の重複確認
-                if discord.utils.get(guild.text_channels, name=task_name):
+                if index.text_channel(guild, task_name):
                     await select_interaction.response.send_message(f"`{task_name}` は既に存在します。", ephemeral=True)
                     return
 
@@ -44,7 +46,7 @@ class TaskNameModal(ui.Modal, title="タスク名を入力してください"):
                     interaction.user: PermissionOverwrite(view_channel=True, send_messages=True, read_message_history=True),  # 作成者を追加
                 }
 
-                category = discord.utils.get(guild.categories, name="タスク")
+                category = index.category(guild, "タスク")
 
                 # チャンネル作成
                 channel: TextChannel = await guild.create_text_channel(
@@ -2,33 +2,217 @@ import discord
 from discord import app_commands, Interaction
 from discord.ext import commands
 import aiohttp
-from bs4 import BeautifulSoup
+import asyncio
+from bs4 import BeautifulSoup, SoupStrainer
 import re
 import io
+import csv
+from typing import Optional
 
-from config import ADMIN_GUILD_ID
+from config import (
+    ADMIN_GUILD_ID, MC_HTTP_MAX_CONNECTIONS, MC_HTTP_MAX_CONNECTIONS_PER_HOST, MC_HTTP_KEEPALIVE_TIMEOUT,
+    MC_HTTP_DNS_CACHE_TTL, MC_HTTP_CONNECT_TIMEOUT, MC_HTTP_TIMEOUT,
+    MC_UUID_CACHE_TTL, MC_UUID_NEGATIVE_CACHE_TTL, MC_UUID_CACHE_MAX_ENTRIES,
+    MC_AVATAR_CACHE_TTL, MC_AVATAR_CACHE_MAX_BYTES, MC_AVATAR_TIMEOUT, MC_MCBANS_TIMEOUT,
+    MC_MCBANS_CACHE_TTL, MC_MCBANS_CACHE_MAX_ENTRIES, MC_BULK_MAX_NAMES, MC_BULK_CONCURRENCY
+)
+from ttl_cache import TTLCache
+
+# Mojang の一括検索 API (1 リクエストあたり 10 件まで)
+MOJANG_BULK_URL = "https://api.mojang.com/profiles/minecraft"
+MOJANG_BULK_BATCH_SIZE = 10
+# Minecraft のユーザー名として有効な形式 (一括検索 API は無効な名前が混ざるとバッチ全体を 400 で弾く)
+USERNAME_PATTERN = re.compile(r"^[A-Za-z0-9_]{1,16}$")
+# MCBans はブラウザ以外の User-Agent を弾くため、ブラウザの値を名乗る
+MCBANS_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+# MCBans のページから必要なのは評価値の欄 (fieldset) と Ban 一覧の表 (tbody) だけなので、それ以外の要素は木を作らない
+MCBANS_STRAINER = SoupStrainer(["fieldset", "tbody"])
+# 評価値の欄は "7 / 10" のような形式
+REPUTATION_PATTERN = re.compile(r"^\s*(\d+)\s*/")
+
+# --------------------------------------------------------------------------------
+# 🔹 キャッシュ
+#    ユーザー名 -> UUID の対応とアバター画像はめったに変わらず、Mojang API のレート制限も厳しいため、
+#    一定時間メモリ上に保持する。存在しないユーザー名 (404) も短い期間だけ覚えておく。
+# --------------------------------------------------------------------------------
+_uuid_cache = TTLCache(MC_UUID_CACHE_TTL, max_entries=MC_UUID_CACHE_MAX_ENTRIES)
+_avatar_cache = TTLCache(MC_AVATAR_CACHE_TTL, max_bytes=MC_AVATAR_CACHE_MAX_BYTES)
+# MCBans の解析結果 (UUID ごと)。キャッシュ中は取得も解析も行わない
+_mcbans_cache = TTLCache(MC_MCBANS_CACHE_TTL, max_entries=MC_MCBANS_CACHE_MAX_ENTRIES)
 
 # --------------------------------------------------------------------------------
 # 🔹 ヘルパー関数
 # --------------------------------------------------------------------------------
-async def get_minecraft_uuid(username: str) -> dict:
+def create_http_session() -> aiohttp.ClientSession:
+    """
+    /mc コマンド群で共有する HTTP セッションを作成します。
+    Keep-Alive で接続を使い回し、DNS の解決結果もキャッシュするため、2 回目以降のリクエストではハンドシェイクが省かれます。
+    """
+    connector = aiohttp.TCPConnector(
+        limit=MC_HTTP_MAX_CONNECTIONS,
+        limit_per_host=MC_HTTP_MAX_CONNECTIONS_PER_HOST,
+        keepalive_timeout=MC_HTTP_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=MC_HTTP_DNS_CACHE_TTL,
+    )
+    timeout = aiohttp.ClientTimeout(total=MC_HTTP_TIMEOUT, sock_connect=MC_HTTP_CONNECT_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+async def get_minecraft_uuid(session: aiohttp.ClientSession, username: str) -> dict:
     """
     Mojang APIを使用してMinecraftユーザー名からUUIDを取得します。
-    成功時は{'uuid': '...', 'username': '...'}、失敗時は{'error': '...'}を返します。
+    成功時は{'uuid': '...', 'username': '...'}、失敗時は{'error': '...'}を返します (存在しない場合は 'not_found': True も付く)。
+    成功と 404 の結果はキャッシュし、それ以外のエラー (一時的なもの) はキャッシュしません。
     """
+    # Minecraft のユーザー名は大文字小文字を区別しない
+    cache_key = username.lower()
+    cached = _uuid_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     url = f"https://api.mojang.com/users/profiles/minecraft/{username}"
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return {"uuid": data["id"], "username": data["name"]}
-                elif response.status == 404:
-                    return {"error": f"ユーザー `{username}` が見つかりませんでした。"}
-                else:
-                    return {"error": f"APIエラーが発生しました (ステータスコード: {response.status})。"}
-    except aiohttp.ClientError as e:
-        return {"error": f"APIへの接続中にエラーが発生しました: {e}"}
+        async with session.get(url) as response:
+            if response.status == 200:
+                data = await response.json()
+                result = {"uuid": data["id"], "username": data["name"]}
+                _uuid_cache.set(cache_key, result)
+                return result
+            elif response.status in (204, 404):
+                result = {"error": f"ユーザー `{username}` が見つかりませんでした。", "not_found": True}
+                _uuid_cache.set(cache_key, result, ttl=MC_UUID_NEGATIVE_CACHE_TTL)
+                return result
+            else:
+                return {"error": f"APIエラーが発生しました (ステータスコード: {response.status})。"}
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return {"error": f"APIへの接続中にエラーが発生しました: {e!r}"}
+
+async def get_minecraft_uuids_bulk(session: aiohttp.ClientSession, usernames: list, concurrency: int = MC_BULK_CONCURRENCY) -> dict:
+    """
+    Mojang の一括検索 API で複数のユーザー名を UUID に変換します。
+    {小文字のユーザー名: get_minecraft_uuid() と同じ形式の結果} を返します。
+    キャッシュ済みの名前は問い合わせず、残りを 10 件ずつのバッチにして最大 concurrency 個まで並行して送ります。
+    """
+    results = {}
+    pending = {}
+    for username in usernames:
+        cache_key = username.lower()
+        if cache_key in results or cache_key in pending:
+            continue
+        cached = _uuid_cache.get(cache_key)
+        if cached is not None:
+            results[cache_key] = cached
+        else:
+            pending[cache_key] = username
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def lookup_batch(batch: list) -> dict:
+        async with semaphore:
+            try:
+                async with session.post(MOJANG_BULK_URL, json=batch) as response:
+                    if response.status != 200:
+                        error = {"error": f"APIエラーが発生しました (ステータスコード: {response.status})。"}
+                        return {name.lower(): error for name in batch}
+                    profiles = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = {"error": f"APIへの接続中にエラーが発生しました: {e!r}"}
+                return {name.lower(): error for name in batch}
+
+        # 見つからなかった名前は応答に含まれないので、含まれなかった名前を 404 と同じ扱いにする
+        found = {profile["name"].lower(): {"uuid": profile["id"], "username": profile["name"]} for profile in profiles}
+        batch_results = {}
+        for name in batch:
+            cache_key = name.lower()
+            if cache_key in found:
+                batch_results[cache_key] = found[cache_key]
+                _uuid_cache.set(cache_key, found[cache_key])
+            else:
+                batch_results[cache_key] = {"error": f"ユーザー `{name}` が見つかりませんでした。", "not_found": True}
+                _uuid_cache.set(cache_key, batch_results[cache_key], ttl=MC_UUID_NEGATIVE_CACHE_TTL)
+        return batch_results
+
+    names = list(pending.values())
+    batches = [names[i:i + MOJANG_BULK_BATCH_SIZE] for i in range(0, len(names), MOJANG_BULK_BATCH_SIZE)]
+    for batch_results in await asyncio.gather(*(lookup_batch(batch) for batch in batches)):
+        results.update(batch_results)
+    return results
+
+async def download_avatar(session: aiohttp.ClientSession, uuid: str, timeout: float = MC_AVATAR_TIMEOUT) -> Optional[bytes]:
+    """
+    crafatar から頭部のレンダー画像を取得します (UUID ごとにキャッシュ)。
+    アバターは付加情報なので、timeout 秒以内に取得できなければ諦めて None を返します (失敗時も None)。
+    """
+    cache_key = uuid.replace("-", "").lower()
+    cached = _avatar_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    avatar_url = f"https://crafatar.com/renders/head/{uuid}"
+    try:
+        async with session.get(avatar_url, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+            if resp.status == 200:
+                image_data = await resp.read()
+                _avatar_cache.set(cache_key, image_data)
+                return image_data
+    except Exception as e:
+        print(f"アバター画像のダウンロードに失敗しました: {e!r}")
+    return None
+
+async def fetch_mcbans_page(session: aiohttp.ClientSession, uuid: str) -> tuple:
+    """MCBans のプレイヤーページを取得し、(ステータスコード, HTML) を返します。"""
+    mcbans_url = f"https://mcbans.com/player/{uuid}/"
+    headers = {"User-Agent": MCBANS_USER_AGENT}
+    async with session.get(mcbans_url, headers=headers, timeout=aiohttp.ClientTimeout(total=MC_MCBANS_TIMEOUT)) as response:
+        if response.status != 200:
+            return response.status, None
+        return response.status, await response.text()
+
+def parse_mcbans_page(html: str) -> dict:
+    """
+    MCBans のプレイヤーページから評価値と Ban 一覧を取り出します (CPU 処理なのでスレッドで実行する想定)。
+    {'reputation': '7 / 10' または None, 'bans': [{'scope', 'server', 'reason', 'date'}, ...]} を返します。
+    """
+    soup = BeautifulSoup(html, "html.parser", parse_only=MCBANS_STRAINER)
+
+    # 評価値はプロフィール欄 (fieldset) の 2 番目の section にある。
+    # fieldset 以外は読み込んでいないため、形式が一致する最初の欄を評価値とみなす
+    reputation = None
+    for element in soup.select("fieldset > section:nth-child(2) > div"):
+        raw_text = element.get_text(strip=True)
+        if REPUTATION_PATTERN.match(raw_text):
+            reputation = raw_text
+            break
+
+    ban_list = []
+    for tbody in soup.find_all("tbody"):
+        for row in tbody.find_all("tr"):
+            cols = row.find_all("td")
+            if len(cols) < 6: continue
+            scope = cols[0].get_text(strip=True)
+            server = cols[2].get_text(strip=True)
+            reason = cols[4].get_text(strip=True)
+            date = cols[5].get_text(strip=True) # 日付も取得
+            if "Global" in scope or "Local" in scope:
+                ban_list.append({"scope": scope, "server": server, "reason": reason, "date": date})
+
+    return {"reputation": reputation, "bans": ban_list}
+
+async def get_mcbans_report(session: aiohttp.ClientSession, uuid: str) -> tuple:
+    """
+    MCBans の評価値と Ban 一覧を (ステータスコード, 解析結果) で返します。取得に失敗した場合の解析結果は None です。
+    解析結果は UUID ごとにキャッシュし、期限内の再検索では取得も解析も行いません。
+    """
+    cache_key = uuid.replace("-", "").lower()
+    cached = _mcbans_cache.get(cache_key)
+    if cached is not None:
+        return 200, cached
+
+    status, html = await fetch_mcbans_page(session, uuid)
+    if html is None:
+        return status, None
+    report = await asyncio.to_thread(parse_mcbans_page, html)
+    _mcbans_cache.set(cache_key, report)
+    return status, report
 
 def create_progress_bar(value: int, max_value: int = 10) -> str:
     """
@@ -49,31 +233,34 @@ class McCommands(commands.GroupCog, name="mc"):
     """Minecraft関連の情報を検索するコマンド群"""
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.session: Optional[aiohttp.ClientSession] = None
         super().__init__()
 
+    async def cog_load(self):
+        self.session = create_http_session()
+
+    async def cog_unload(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
     # --- 1. search_uuid サブコマンド ---
     @app_commands.command(name="search_uuid", description="Minecraftユーザー名からUUIDを検索します。")
     @app_commands.describe(username="Minecraftのユーザー名")
     async def search_uuid(self, interaction: Interaction, username: str):
         await interaction.response.defer()
-        result = await get_minecraft_uuid(username)
+        result = await get_minecraft_uuid(self.session, username)
 
         if "error" in result:
             await interaction.followup.send(f"❌ {result['error']}")
             return
 
-        avatar_url = f"https://crafatar.com/renders/head/{result['uuid']}"
         avatar_filename = "avatar.png"
         avatar_file = None
 
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(avatar_url) as resp:
-                    if resp.status == 200:
-                        image_data = await resp.read()
-                        avatar_file = discord.File(io.BytesIO(image_data), filename=avatar_filename)
-        except Exception as e:
-            print(f"アバター画像のダウンロードに失敗しました: {e}")
+        image_data = await download_avatar(self.session, result['uuid'])
+        if image_data:
+            avatar_file = discord.File(io.BytesIO(image_data), filename=avatar_filename)
 
         embed = discord.Embed(
             title=f"✅ UUID検索結果: `{result['username']}`",
@@ -99,67 +286,33 @@ class McCommands(commands.GroupCog, name="mc"):
         if re.match(r"^[0-9a-fA-F]{32}$", username):
             uuid = username
         else:
-            uuid_result = await get_minecraft_uuid(username)
+            uuid_result = await get_minecraft_uuid(self.session, username)
             if "error" in uuid_result:
                 await interaction.followup.send(f"❌ {uuid_result['error']}")
                 return
             uuid = uuid_result["uuid"]
             username = uuid_result["username"]
 
-        avatar_url = f"https://crafatar.com/renders/head/{uuid}"
         avatar_filename = "avatar.png"
         avatar_file = None
-
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(avatar_url) as resp:
-                    if resp.status == 200:
-                        image_data = await resp.read()
-                        avatar_file = discord.File(io.BytesIO(image_data), filename=avatar_filename)
-        except Exception as e:
-            print(f"アバター画像のダウンロードに失敗しました: {e}")
-
         mcbans_url = f"https://mcbans.com/player/{uuid}/"
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        }
 
+        # UUID が決まればアバターと MCBans は互いに独立しているので、アバターを先に走らせておき並行して取得する。
+        # アバターは独自の短いタイムアウトで打ち切られるため、Ban 情報の応答を長く待たせることはない
+        avatar_task = asyncio.create_task(download_avatar(self.session, uuid))
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(mcbans_url, headers=headers) as response:
-                    if response.status != 200:
-                        await interaction.followup.send(f"❌ MCBansへのアクセスに失敗しました (ステータスコード: {response.status})。")
-                        return
-                    html = await response.text()
+            status, report = await get_mcbans_report(self.session, uuid)
+            if report is None:
+                await interaction.followup.send(f"❌ MCBansへのアクセスに失敗しました (ステータスコード: {status})。")
+                return
 
-            soup = BeautifulSoup(html, "html.parser")
-            
             reputation_text = "N/A"
             reputation_bar = ""
-            try:
-                selector = "#content > div > div.box-holder-one-third > div > div > fieldset > section:nth-child(2) > div"
-                reputation_element = soup.select_one(selector)
-                if reputation_element:
-                    raw_text = reputation_element.get_text(strip=True)
-                    reputation_text = raw_text
-                    value = int(raw_text.split('/')[0].strip())
-                    reputation_bar = create_progress_bar(value)
-            except Exception as e:
-                print(f"Reputationの解析中にエラーが発生しました: {e}")
-
-            table_bodies = soup.find_all("tbody")
-            ban_list = []
-            for tbody in table_bodies:
-                rows = tbody.find_all("tr")
-                for row in rows:
-                    cols = row.find_all("td")
-                    if len(cols) < 6: continue
-                    scope = cols[0].get_text(strip=True)
-                    server = cols[2].get_text(strip=True)
-                    reason = cols[4].get_text(strip=True)
-                    date = cols[5].get_text(strip=True) # 日付も取得
-                    if "Global" in scope or "Local" in scope:
-                        ban_list.append({"scope": scope, "server": server, "reason": reason, "date": date})
+            if report["reputation"]:
+                reputation_text = report["reputation"]
+                reputation_bar = create_progress_bar(int(REPUTATION_PATTERN.match(reputation_text).group(1)))
+
+            ban_list = report["bans"]
 
             # Embedの作成
             if not ban_list:
@@ -193,16 +346,146 @@ class McCommands(commands.GroupCog, name="mc"):
             embed.add_field(name="MCBans Profile", value=mcbans_url, inline=False)
 
             # メッセージ送信
+            image_data = await avatar_task
+            if image_data:
+                avatar_file = discord.File(io.BytesIO(image_data), filename=avatar_filename)
             if avatar_file:
                 embed.set_thumbnail(url=f"attachment://{avatar_filename}")
                 await interaction.followup.send(embed=embed, file=avatar_file)
             else:
                 await interaction.followup.send(embed=embed)
 
-        except aiohttp.ClientError as e:
-            await interaction.followup.send(f"❌ MCBansへの接続中にエラーが発生しました: {e}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            await interaction.followup.send(f"❌ MCBansへの接続中にエラーが発生しました: {e!r}")
         except Exception as e:
             await interaction.followup.send(f"❌ データの解析中に予期せぬエラーが発生しました: {e}")
+        finally:
+            # MCBans 側で失敗して途中で抜けた場合は、アバターの取得も打ち切る
+            avatar_task.cancel()
+
+    # --- 3. bulk_lookup サブコマンド ---
+    @app_commands.command(name="bulk_lookup", description="複数のMinecraftユーザー名をまとめて検索します。")
+    @app_commands.describe(
+        usernames="Minecraftのユーザー名 (スペース・カンマ・改行区切りで複数指定)",
+        check_mcbans="MCBansのBan履歴もあわせて確認する"
+    )
+    async def bulk_lookup(self, interaction: Interaction, usernames: str, check_mcbans: bool = False):
+        await interaction.response.defer()
+
+        names = []
+        invalid_names = []
+        seen = set()
+        for name in re.split(r"[\s,]+", usernames):
+            if not name or name.lower() in seen:
+                continue
+            seen.add(name.lower())
+            if USERNAME_PATTERN.match(name):
+                names.append(name)
+            else:
+                invalid_names.append(name)
+
+        if not names and not invalid_names:
+            await interaction.followup.send("❌ ユーザー名を指定してください。")
+            return
+        if len(names) > MC_BULK_MAX_NAMES:
+            await interaction.followup.send(f"❌ 一度に検索できるのは {MC_BULK_MAX_NAMES} 件までです ({len(names)} 件指定されました)。")
+            return
+
+        results = await get_minecraft_uuids_bulk(self.session, names)
+
+        # MCBans は UUID が見つかったプレイヤーだけを、同時実行数を絞って並行に確認する
+        reports = {}
+        if check_mcbans:
+            semaphore = asyncio.Semaphore(MC_BULK_CONCURRENCY)
+
+            async def check(uuid: str):
+                async with semaphore:
+                    try:
+                        status, report = await get_mcbans_report(self.session, uuid)
+                    except Exception as e:
+                        return uuid, {"error": f"MCBansの確認中にエラーが発生しました: {e!r}"}
+                    if report is None:
+                        return uuid, {"error": f"MCBansへのアクセスに失敗しました (ステータスコード: {status})。"}
+                    return uuid, report
+
+            uuids = {result["uuid"] for result in results.values() if "uuid" in result}
+            reports = dict(await asyncio.gather(*(check(uuid) for uuid in uuids)))
+
+        # 結果を CSV にまとめる (Excel でも文字化けしないよう BOM 付き UTF-8)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        header = ["入力名", "ユーザー名", "UUID", "結果"]
+        if check_mcbans:
+            header += ["評価値", "Global Ban", "Local Ban", "MCBans"]
+        writer.writerow(header)
+
+        found_count = not_found_count = error_count = 0
+        banned_players = []
+        for name in names:
+            result = results[name.lower()]
+            if "uuid" not in result:
+                if result.get("not_found"):
+                    not_found_count += 1
+                    row = [name, "", "", "見つかりませんでした"]
+                else:
+                    error_count += 1
+                    row = [name, "", "", result["error"]]
+                writer.writerow(row)
+                continue
+
+            found_count += 1
+            row = [name, result["username"], result["uuid"], "OK"]
+            if check_mcbans:
+                report = reports[result["uuid"]]
+                if "error" in report:
+                    row += ["", "", "", report["error"]]
+                else:
+                    global_bans = sum(1 for ban in report["bans"] if "Global" in ban["scope"])
+                    local_bans = len(report["bans"]) - global_bans
+                    row += [report["reputation"] or "N/A", global_bans, local_bans, f"https://mcbans.com/player/{result['uuid']}/"]
+                    if report["bans"]:
+                        banned_players.append((result["username"], global_bans, local_bans))
+            writer.writerow(row)
+        for name in invalid_names:
+            writer.writerow([name, "", "", "無効なユーザー名"] + ([""] * 4 if check_mcbans else []))
+
+        report_file = discord.File(io.BytesIO(buffer.getvalue().encode("utf-8-sig")), filename="mc_bulk_lookup.csv")
+
+        embed = discord.Embed(
+            title=f"📋 一括検索結果 ({len(names) + len(invalid_names)} 件)",
+            color=discord.Color.red() if banned_players else discord.Color.green()
+        )
+        embed.add_field(name="見つかった", value=str(found_count), inline=True)
+        embed.add_field(name="見つからない", value=str(not_found_count), inline=True)
+        embed.add_field(name="エラー / 無効", value=f"{error_count} / {len(invalid_names)}", inline=True)
+        if check_mcbans:
+            if banned_players:
+                lines = [f"`{username}` - Global {g} / Local {l}" for username, g, l in banned_players[:10]]
+                if len(banned_players) > 10:
+                    lines.append(f"...ほか {len(banned_players) - 10} 人 (詳細は添付ファイルを参照)")
+                embed.add_field(name=f"⚠️ Ban履歴あり ({len(banned_players)} 人)", value="\n".join(lines), inline=False)
+            else:
+                embed.add_field(name="Ban履歴", value="Ban履歴のあるプレイヤーはいませんでした。", inline=False)
+
+        await interaction.followup.send(embed=embed, file=report_file)
+
+    # --- 4. cache_stats サブコマンド ---
+    @app_commands.command(name="cache_stats", description="UUID・アバター・MCBansキャッシュの利用状況を表示します。")
+    async def cache_stats(self, interaction: Interaction):
+        embed = discord.Embed(title="📊 /mc キャッシュ統計", color=discord.Color.blurple())
+        for label, cache in (("UUID", _uuid_cache), ("アバター", _avatar_cache), ("MCBans", _mcbans_cache)):
+            stats = cache.stats()
+            size_text = f" ({stats['bytes'] / 1024:.1f} KiB)" if cache.max_bytes else ""
+            embed.add_field(
+                name=label,
+                value=(
+                    f"**件　　数:** {stats['entries']}{size_text}\n"
+                    f"**ヒット:** {stats['hits']} / **ミス:** {stats['misses']} ({stats['hit_rate']:.0%})\n"
+                    f"**破　　棄:** {stats['evictions']}"
+                ),
+                inline=False
+            )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
 # --------------------------------------------------------------------------------
 # 🔹 Botにコマンドを登録
@@ -1,9 +1,15 @@
 # commands/autorole.py (機能追加・修正版)
+# 再試行対象のユーザーID一覧 (ROLE_SYNC_RETRY_KEY) は長くなるため、bot_state.state_value は TEXT とする。
+#
+#   ALTER TABLE bot_state MODIFY state_value TEXT NOT NULL;
 
 import discord
 from discord import app_commands, Object, Interaction
 from discord.ext import commands
 import mysql.connector
+import asyncio
+import datetime
+import time
 from typing import Optional
 
 # config.py から必要な設定値を読み込む
@@ -13,101 +19,109 @@ from config import (
     USER_ROLE_ID,
     STAFF_ROLE_ID,
     ESCALATE_ROLE_ID,
-    DB_HOST,
-    DB_USER,
-    DB_PASSWORD,
-    DB_NAME
+    ROLE_ROSTER_TTL,
+    ROLE_SYNC_CONCURRENCY,
+    ROLE_SYNC_PROGRESS_INTERVAL
 )
+# DBアクセスは Bot 共通の非同期層 (接続プール + DB専用スレッド) を経由する
+from db import fetch_all, fetch_one, get_state, set_state
 
-# データベース接続を管理する関数
-def get_db_connection():
-    return mysql.connector.connect(
-        host=DB_HOST,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME
-    )
+# --------------------------------------------------------------------------------
+# 0. SupportUsers 名簿のキャッシュ
+#    メンバーごとに SELECT するのではなく、テーブル全体を一度だけ読み込んで
+#    {UserId: Is_EscalateEng} の辞書として保持する。
+# --------------------------------------------------------------------------------
+_roster_cache: dict = {}
+_roster_loaded_at: Optional[float] = None
+_roster_lock = asyncio.Lock()
+
+async def load_support_roster(max_age: float = ROLE_ROSTER_TTL) -> dict:
+    """
+    SupportUsers の全件を {UserId: Is_EscalateEng} として返す。
+    max_age 秒以内に読み込んだキャッシュがあればそれを再利用する (0 なら必ず再読み込み)。
+    """
+    global _roster_cache, _roster_loaded_at
+    async with _roster_lock:
+        if _roster_loaded_at is None or time.monotonic() - _roster_loaded_at >= max_age:
+            rows = await fetch_all("SELECT UserId, Is_EscalateEng FROM SupportUsers")
+            _roster_cache = {int(user_id): bool(is_escalate) for user_id, is_escalate in rows}
+            _roster_loaded_at = time.monotonic()
+        return _roster_cache
 
 # --------------------------------------------------------------------------------
 # 1. ロールチェックと付与の共通ロジック
 # --------------------------------------------------------------------------------
-async def check_and_assign_roles(member: discord.Member) -> str:
+def compute_role_diff(member: discord.Member, roster: dict):
     """
-    指定されたメンバーのロールをDBと照合し、必要に応じて付与・削除する共通関数。
-    戻り値として処理内容の文字列を返す。
+    名簿と照合して (付与するロール, 削除するロール, 種別) を返す。Discord への通信は行わない。
+    種別は "スタッフ" または "一般ユーザー"。
     """
-    if member.bot:
-        return "対象外 (Bot)"
-
     guild = member.guild
     current_role_ids = {role.id for role in member.roles}
-    
-    # --- スタッフかどうかのDBチェック ---
-    try:
-        db_conn = get_db_connection()
-        cursor = db_conn.cursor()
-        query = "SELECT Is_EscalateEng FROM SupportUsers WHERE UserId = %s"
-        cursor.execute(query, (member.id,))
-        result = cursor.fetchone()
-        cursor.close()
-        db_conn.close()
-
-        # --- DBにレコードが存在した場合 (スタッフ) ---
-        if result:
-            is_escalate_eng = result[0]
-            
-            staff_role = guild.get_role(STAFF_ROLE_ID)
-            staff_lead_role = guild.get_role(ESCALATE_ROLE_ID)
-            welcome_role = guild.get_role(USER_ROLE_ID)
 
-            roles_to_add = []
-            roles_to_remove = []
+    welcome_role = guild.get_role(USER_ROLE_ID)
+    staff_role = guild.get_role(STAFF_ROLE_ID)
+    staff_lead_role = guild.get_role(ESCALATE_ROLE_ID)
 
-            if staff_role and staff_role.id not in current_role_ids:
-                roles_to_add.append(staff_role)
-            
-            if is_escalate_eng and staff_lead_role and staff_lead_role.id not in current_role_ids:
-                roles_to_add.append(staff_lead_role)
-            elif not is_escalate_eng and staff_lead_role and staff_lead_role.id in current_role_ids:
-                roles_to_remove.append(staff_lead_role)
-            
-            if welcome_role and welcome_role.id in current_role_ids:
-                roles_to_remove.append(welcome_role)
+    roles_to_add = []
+    roles_to_remove = []
 
-            if roles_to_add:
-                await member.add_roles(*roles_to_add, reason="役割の自動同期")
-            if roles_to_remove:
-                await member.remove_roles(*roles_to_remove, reason="役割の自動同期")
-            
-            if roles_to_add or roles_to_remove:
-                return f"スタッフとして同期: {member.display_name}"
-            return "変更なし (スタッフ)"
+    # --- 名簿にレコードが存在した場合 (スタッフ) ---
+    if member.id in roster:
+        is_escalate_eng = roster[member.id]
 
-        # --- DBにレコードが存在しなかった場合 (一般ユーザー) ---
-        else:
-            welcome_role = guild.get_role(USER_ROLE_ID)
-            staff_role = guild.get_role(STAFF_ROLE_ID)
-            staff_lead_role = guild.get_role(ESCALATE_ROLE_ID)
-            
-            roles_to_add = []
-            roles_to_remove = []
+        if staff_role and staff_role.id not in current_role_ids:
+            roles_to_add.append(staff_role)
 
-            if welcome_role and welcome_role.id not in current_role_ids:
-                roles_to_add.append(welcome_role)
+        if is_escalate_eng and staff_lead_role and staff_lead_role.id not in current_role_ids:
+            roles_to_add.append(staff_lead_role)
+        elif not is_escalate_eng and staff_lead_role and staff_lead_role.id in current_role_ids:
+            roles_to_remove.append(staff_lead_role)
 
-            if staff_role and staff_role.id in current_role_ids:
-                roles_to_remove.append(staff_role)
-            if staff_lead_role and staff_lead_role.id in current_role_ids:
-                roles_to_remove.append(staff_lead_role)
+        if welcome_role and welcome_role.id in current_role_ids:
+            roles_to_remove.append(welcome_role)
+        return roles_to_add, roles_to_remove, "スタッフ"
 
-            if roles_to_add:
-                await member.add_roles(*roles_to_add, reason="役割の自動同期")
-            if roles_to_remove:
-                await member.remove_roles(*roles_to_remove, reason="役割の自動同期")
+    # --- 名簿にレコードが存在しなかった場合 (一般ユーザー) ---
+    if welcome_role and welcome_role.id not in current_role_ids:
+        roles_to_add.append(welcome_role)
 
-            if roles_to_add or roles_to_remove:
-                return f"一般ユーザーとして同期: {member.display_name}"
-            return "変更なし (一般)"
+    if staff_role and staff_role.id in current_role_ids:
+        roles_to_remove.append(staff_role)
+    if staff_lead_role and staff_lead_role.id in current_role_ids:
+        roles_to_remove.append(staff_lead_role)
+    return roles_to_add, roles_to_remove, "一般ユーザー"
+
+
+async def apply_role_diff(member: discord.Member, roles_to_add: list, roles_to_remove: list):
+    """
+    同期対象のロールだけをロールごとのリクエストで付与・削除する。
+    メンバーのロール一覧全体を置き換えないため、同期中に他の Bot やモデレーターが変更したロールを上書きしない。
+    """
+    if roles_to_add:
+        await member.add_roles(*roles_to_add, reason="役割の自動同期")
+    if roles_to_remove:
+        await member.remove_roles(*roles_to_remove, reason="役割の自動同期")
+
+
+async def check_and_assign_roles(member: discord.Member, roster: Optional[dict] = None) -> str:
+    """
+    指定されたメンバーのロールをDBと照合し、必要に応じて付与・削除する共通関数。
+    roster を渡した場合はそれを使い、省略時はキャッシュ済みの名簿 (TTL 付き) を使う。
+    戻り値として処理内容の文字列を返す。
+    """
+    if member.bot:
+        return "対象外 (Bot)"
+
+    try:
+        if roster is None:
+            roster = await load_support_roster()
+
+        roles_to_add, roles_to_remove, kind = compute_role_diff(member, roster)
+        if roles_to_add or roles_to_remove:
+            await apply_role_diff(member, roles_to_add, roles_to_remove)
+            return f"{kind}として同期: {member.display_name}"
+        return "変更なし (スタッフ)" if kind == "スタッフ" else "変更なし (一般)"
 
     except mysql.connector.Error as err:
         return f"DBエラー: {err}"
@@ -118,7 +132,158 @@ async def check_and_assign_roles(member: discord.Member) -> str:
 
 
 # --------------------------------------------------------------------------------
-# 2. 各タイミングで共通ロジックを呼び出す
+# 2. ギルド全体のロール同期エンジン
+#    先に全メンバーの差分を計算し、変更が必要なメンバーだけを並列数を制限して適用する。
+#    ルートごとのレート制限バケット (待機・429 の再試行) は discord.py の HTTP クライアントが
+#    管理しているため、ここでは同時実行数をバケットの許容量以下に抑えることで枠を使い切らないようにする。
+# --------------------------------------------------------------------------------
+class RoleSyncEngine:
+    def __init__(self, concurrency: int = ROLE_SYNC_CONCURRENCY, progress_interval: float = ROLE_SYNC_PROGRESS_INTERVAL):
+        self.concurrency = max(1, concurrency)
+        self.progress_interval = progress_interval
+        self.total = 0
+        self.processed = 0
+        self.changed = 0
+        self.failed = 0
+        self.errors = []
+        # 再試行すれば成功する可能性がある失敗 (権限不足以外) のユーザーID
+        self.retry_ids = set()
+
+    def progress_text(self) -> str:
+        return f"処理済み {self.processed}/{self.total} ・ 更新 {self.changed} ・ 失敗 {self.failed}"
+
+    async def run(self, members, roster: dict, on_progress=None) -> "RoleSyncEngine":
+        """
+        members を roster と照合して同期する。
+        on_progress が指定されていれば、progress_interval 秒ごとと完了時に await on_progress(self) を呼ぶ。
+        """
+        members = [member for member in members if not member.bot]
+        self.total = len(members)
+
+        # 1. 差分をすべて計算 (Discord への通信なし)
+        pending = []
+        for member in members:
+            roles_to_add, roles_to_remove, _ = compute_role_diff(member, roster)
+            if roles_to_add or roles_to_remove:
+                pending.append((member, roles_to_add, roles_to_remove))
+            else:
+                self.processed += 1
+
+        # 2. 変更が必要なメンバーだけを並列数を制限して適用
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def worker(member, roles_to_add, roles_to_remove):
+            async with semaphore:
+                try:
+                    await apply_role_diff(member, roles_to_add, roles_to_remove)
+                    self.changed += 1
+                except discord.Forbidden as e:
+                    # サーバーオーナーや Bot より上位のメンバーは何度やっても編集できないため再試行しない
+                    self.failed += 1
+                    self.errors.append(f"{member.display_name}: {e}")
+                except Exception as e:
+                    # HTTP エラー以外も失敗として数え、タスクの例外が取りこぼされないようにする
+                    self.failed += 1
+                    self.retry_ids.add(member.id)
+                    self.errors.append(f"{member.display_name}: {type(e).__name__}: {e}")
+                finally:
+                    self.processed += 1
+
+        tasks = [asyncio.create_task(worker(*item)) for item in pending]
+        if on_progress:
+            await on_progress(self)
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, timeout=self.progress_interval)
+            if on_progress and tasks:
+                await on_progress(self)
+        if on_progress:
+            await on_progress(self)
+        return self
+
+
+# --------------------------------------------------------------------------------
+# 3. SupportUsers の変更履歴に基づく差分同期
+#    SupportUsers への INSERT / UPDATE / DELETE をトリガーで SupportUsersChangeLog に記録し、
+#    前回同期時点の変更ID (ウォーターマーク) より後に変化したユーザーと、
+#    前回同期以降にサーバーへ参加したメンバーだけを同期する。
+#
+#   CREATE TABLE SupportUsersChangeLog (
+#       id         BIGINT   NOT NULL AUTO_INCREMENT PRIMARY KEY,
+#       UserId     BIGINT   NOT NULL,
+#       changed_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+#   );
+#   CREATE TRIGGER SupportUsers_ai AFTER INSERT ON SupportUsers FOR EACH ROW
+#       INSERT INTO SupportUsersChangeLog (UserId) VALUES (NEW.UserId);
+#   CREATE TRIGGER SupportUsers_au AFTER UPDATE ON SupportUsers FOR EACH ROW
+#       INSERT INTO SupportUsersChangeLog (UserId) VALUES (OLD.UserId), (NEW.UserId);
+#   CREATE TRIGGER SupportUsers_ad AFTER DELETE ON SupportUsers FOR EACH ROW
+#       INSERT INTO SupportUsersChangeLog (UserId) VALUES (OLD.UserId);
+# --------------------------------------------------------------------------------
+ROLE_SYNC_WATERMARK_KEY = "role_sync.change_id"
+ROLE_SYNC_TIME_KEY = "role_sync.synced_at"
+# 前回の同期で一時的なエラーにより更新できなかったユーザーID (カンマ区切り)。次回の差分同期の対象に加える
+ROLE_SYNC_RETRY_KEY = "role_sync.retry_ids"
+_ROSTER_QUERY_CHUNK = 500
+
+async def load_roster_for(user_ids) -> dict:
+    """指定したユーザーIDの分だけ SupportUsers を読み込み、{UserId: Is_EscalateEng} を返す。"""
+    user_ids = list(user_ids)
+    roster = {}
+    for i in range(0, len(user_ids), _ROSTER_QUERY_CHUNK):
+        chunk = user_ids[i:i + _ROSTER_QUERY_CHUNK]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        rows = await fetch_all(f"SELECT UserId, Is_EscalateEng FROM SupportUsers WHERE UserId IN ({placeholders})", chunk)
+        roster.update({int(user_id): bool(is_escalate) for user_id, is_escalate in rows})
+    return roster
+
+async def sync_guild_roles(guild: discord.Guild, full: bool = False, on_progress=None):
+    """
+    ギルドのロールを同期し、(RoleSyncEngine, 実行モード) を返す。
+    ウォーターマークが保存済みなら変更のあったメンバーだけを対象にする差分同期、
+    未保存・full=True・変更履歴が欠けている場合は全メンバーを対象にする。
+    ウォーターマークは失敗の有無にかかわらず今回の変更IDと同期時刻まで進め、
+    一時的なエラーで更新できなかったメンバーは次回の差分同期で再試行する。
+    """
+    started_at = datetime.datetime.now(datetime.timezone.utc)
+    min_change_id, max_change_id = await fetch_one("SELECT MIN(id), MAX(id) FROM SupportUsersChangeLog")
+    max_change_id = max_change_id or 0
+
+    watermark = await get_state(ROLE_SYNC_WATERMARK_KEY)
+    synced_at = await get_state(ROLE_SYNC_TIME_KEY)
+    if watermark is not None and min_change_id is not None and int(watermark) < min_change_id - 1:
+        # 前回以降の変更履歴が削除されているため差分を特定できない
+        full = True
+
+    if full or watermark is None or synced_at is None:
+        mode = "full"
+        roster = await load_support_roster(max_age=0)
+        members = guild.members
+    else:
+        mode = "delta"
+        rows = await fetch_all(
+            "SELECT DISTINCT UserId FROM SupportUsersChangeLog WHERE id > %s AND id <= %s",
+            (int(watermark), max_change_id)
+        )
+        target_ids = {int(user_id) for (user_id,) in rows}
+        retry_ids = await get_state(ROLE_SYNC_RETRY_KEY)
+        if retry_ids:
+            target_ids.update(int(user_id) for user_id in retry_ids.split(","))
+        last_synced_at = datetime.datetime.fromisoformat(synced_at)
+        target_ids.update(
+            member.id for member in guild.members if member.joined_at and member.joined_at >= last_synced_at
+        )
+        members = [member for member in map(guild.get_member, target_ids) if member]
+        roster = await load_roster_for(target_ids)
+
+    engine = await RoleSyncEngine().run(members, roster, on_progress=on_progress)
+    await set_state(ROLE_SYNC_RETRY_KEY, ",".join(str(user_id) for user_id in sorted(engine.retry_ids)))
+    await set_state(ROLE_SYNC_WATERMARK_KEY, max_change_id)
+    await set_state(ROLE_SYNC_TIME_KEY, started_at.isoformat())
+    return engine, mode
+
+
+# --------------------------------------------------------------------------------
+# 4. 各タイミングで共通ロジックを呼び出す
 # --------------------------------------------------------------------------------
 async def setup(bot: commands.Bot):
     
@@ -134,11 +299,19 @@ async def setup(bot: commands.Bot):
                 print(f"❌ ギルド {USER_GUILD_ID} が見つかりません。")
                 return
 
-            print(f"✅ ギルド '{guild.name}' の {len(guild.members)} 人のメンバーをチェックします。")
-            for member in guild.members:
-                await check_and_assign_roles(member)
+            async def report(engine: RoleSyncEngine):
+                print(f"  - ロールチェック進捗: {engine.progress_text()}")
+
+            try:
+                engine, mode = await sync_guild_roles(guild, on_progress=report)
+            except mysql.connector.Error as err:
+                print(f"❌ SupportUsers の読み込みに失敗しました: {err}")
+                return
+
+            for error in engine.errors:
+                print(f"  - ロール更新に失敗しました: {error}")
 
-            print("✅ Bot起動時の全メンバーロールチェックが完了しました。")
+            print(f"✅ Bot起動時のロールチェックが完了しました。(モード: {mode}, 対象: {engine.total} 人)")
 
     # --- ユーザー参加時に実行するリスナー ---
     @bot.listen('on_member_join')
@@ -177,14 +350,30 @@ async def setup(bot: commands.Bot):
         else:
             await interaction.response.defer(ephemeral=True, thinking=True)
             print("▶️ /role_check コマンドによる全メンバーのロールチェックを開始します...")
-            
-            updated_count = 0
-            for member in user_guild.members:
-                status = await check_and_assign_roles(member)
-                if "同期" in status:
-                    updated_count += 1
-            
-            await interaction.followup.send(f"✅ 全メンバーのロールチェックが完了しました。\n`{updated_count}` 人のメンバーのロールが更新されました。", ephemeral=True)
+
+            progress_message = await interaction.followup.send("▶️ ロールチェックを開始します...", ephemeral=True, wait=True)
+
+            async def report(engine: RoleSyncEngine):
+                try:
+                    await progress_message.edit(content=f"▶️ ロールチェック中: {engine.progress_text()}")
+                except discord.HTTPException:
+                    pass  # インタラクションの有効期限切れ等は無視して同期自体は続行する
+
+            try:
+                engine, _ = await sync_guild_roles(user_guild, full=True, on_progress=report)
+            except mysql.connector.Error as err:
+                await progress_message.edit(content=f"❌ SupportUsers の読み込みに失敗しました: {err}")
+                return
+
+            result = f"✅ 全メンバーのロールチェックが完了しました。\n`{engine.changed}` 人のメンバーのロールが更新されました。"
+            if engine.failed:
+                result += f"\n⚠️ `{engine.failed}` 人の更新に失敗しました。"
+            try:
+                await progress_message.edit(content=result)
+            except discord.HTTPException:
+                await interaction.followup.send(result, ephemeral=True)
+            for error in engine.errors:
+                print(f"  - ロール更新に失敗しました: {error}")
             print("✅ /role_check コマンドによる全メンバーのロールチェックが完了しました。")
 
-    bot.tree.add_command(role_check)
\ No newline at end of file
+    bot.tree.add_command(role_check)
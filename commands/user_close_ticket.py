@@ -1,28 +1,23 @@
 import discord
-from discord import app_commands, Interaction, Object, TextStyle, PermissionOverwrite
-from discord.ext import commands, tasks # tasks をインポート
-from discord.ui import Modal, TextInput, View, Button, Select
+from discord import app_commands, Interaction, Object, TextStyle
+from discord.ext import commands
+from discord.ui import Modal, TextInput, View, Button
 
-import mysql.connector
 import datetime
-import io
-from minio import Minio
+import json
+from storage import get_storage
+from job_queue import get_job_queue
+from scheduler import get_scheduler, TICKET_CHANNEL_EXPIRY, ESCALATION_CHANNEL_EXPIRY
+from transcript import get_capture, build_manifest
 
 # configから設定値を読み込み
 from config import (
-    USER_GUILD_ID, ADMIN_GUILD_ID,
-    TICKET_CATEGORY_ID,
-    MINIO_ENDPOINT, MINIO_ACCESS_KEY, MINIO_SECRET_KEY, MINIO_BUCKET_NAME, MINIO_USE_SSL,
-    DB_HOST, DB_USER, DB_PASSWORD, DB_NAME
+    USER_GUILD_ID,
+    TICKET_CATEGORY_ID
 )
+from db import fetch_one, fetch_all, execute, run_db
 
-# --- DBとMinIOクライアントのセットアップ ---
-def get_db_connection():
-    return mysql.connector.connect(host=DB_HOST, user=DB_USER, password=DB_PASSWORD, database=DB_NAME)
-
-minio_client = Minio(
-    MINIO_ENDPOINT, access_key=MINIO_ACCESS_KEY, secret_key=MINIO_SECRET_KEY, secure=MINIO_USE_SSL
-)
+# DBアクセスは db.py の非同期層、MinIO へのアクセスは storage.py の共有クライアントを使用する
 
 # --- UIコンポーネント ---
 # (SurveyFeedbackModal, SurveyView, AssignTicketView, TicketContentModal など、UI関連クラスは変更なしのため省略します)
@@ -52,21 +47,16 @@ class SurveyFeedbackModal(Modal, title="フィードバック"):
         self.feedback_text = feedback_text
 
     async def on_submit(self, interaction: Interaction):
-        db_conn = get_db_connection()
-        cursor = db_conn.cursor()
         # ratingをint型に変換（入力バリデーションも追加可）
         try:
             rating_value = int(self.rating.value)
         except ValueError:
             await interaction.response.send_message("評価は1〜5の数値で入力してください。", ephemeral=True)
             return
-        cursor.execute(
-            "UPDATE ticket_surveys SET rating = %s, feedback = %s WHERE ticket_id = %s", 
+        await execute(
+            "UPDATE ticket_surveys SET rating = %s, feedback = %s WHERE ticket_id = %s",
             (rating_value, self.feedback_text.value, self.ticket_db_id)
         )
-        db_conn.commit()
-        cursor.close()
-        db_conn.close()
         await interaction.response.send_message("貴重なご意見をありがとうございました。", ephemeral=True)
         
 class SurveyView(View):
@@ -78,12 +68,7 @@ class SurveyView(View):
         self.bot = bot
 
     async def interaction_check(self, interaction: Interaction) -> bool:
-        db_conn = get_db_connection()
-        cursor = db_conn.cursor()
-        cursor.execute("SELECT user_id FROM tickets WHERE id = %s", (self.ticket_db_id,))
-        row = cursor.fetchone()
-        cursor.close()
-        db_conn.close()
+        row = await fetch_one("SELECT user_id FROM tickets WHERE id = %s", (self.ticket_db_id,))
         print(f"Interaction check for ticket {self.ticket_db_id}: user_id={row[0] if row else 'None'}, interaction.user.id={interaction.user.id}")
         if row and interaction.user.id == row[0]:
             return True
@@ -91,7 +76,9 @@ class SurveyView(View):
         return False
 
     async def update_survey(self, **kwargs):
-        db_conn = get_db_connection()
+        await run_db(self._update_survey, **kwargs)
+
+    def _update_survey(self, db_conn, **kwargs):
         cursor = db_conn.cursor()
         cursor.execute("SELECT id FROM ticket_surveys WHERE ticket_id = %s", (self.ticket_db_id,))
         if cursor.fetchone():
@@ -107,7 +94,6 @@ class SurveyView(View):
             cursor.execute(sql, values_with_assignee)
         db_conn.commit()
         cursor.close()
-        db_conn.close()
 
     @discord.ui.button(label="はい、解決しました", style=discord.ButtonStyle.success, custom_id="survey_resolved_yes")
     async def resolved_yes(self, interaction: Interaction, button: Button):
@@ -166,90 +152,34 @@ class CloseConfirmView(View):
             await self.process_close(interaction, "お客様からの申し出による Close")
 
     async def process_close(self, interaction: Interaction, close_reason: str):
-        channel = interaction.channel
-        # メッセージ履歴収集（最大1000件）
-        messages = []
-        async for message in channel.history(limit=1000, oldest_first=True):
-            messages.append(message)
-
-        timestamp_str = datetime.datetime.utcnow().strftime("%Y%m%d%H%M%S")
-
-        attachment_upload_errors = []
-        for message in messages:
-            for attachment in message.attachments:
-                try:
-                    file_data = await attachment.read()
-                    attachment_path = f"ticket_logs/{self.CaseId}_{timestamp_str}_attachments/{attachment.filename}"
-                    minio_client.put_object(
-                        MINIO_BUCKET_NAME,
-                        attachment_path,
-                        data=io.BytesIO(file_data),
-                        length=len(file_data),
-                        content_type=attachment.content_type or "application/octet-stream"
-                    )
-                except Exception as e:
-                    attachment_upload_errors.append(f"{attachment.filename}: {str(e)}")
-
-        log_lines = []
-        for message in messages:
-            attachments_info = []
-            for att in message.attachments:
-                attachments_info.append(f"{att.filename} ({att.url})")
-            attachments_text = ", ".join(attachments_info) if attachments_info else ""
-            created_at_str = message.created_at.strftime("%Y-%m-%d %H:%M:%S")
-            log_lines.append(f"[{created_at_str}] {message.author.display_name}: {message.content} {attachments_text}".strip())
-
-        log_text = "\n".join(log_lines)
-
-        # S3アップロード用ファイル名
-        s3_filepath = f"ticket_logs/{self.CaseId}_{timestamp_str}.txt"
-        log_bytes = io.BytesIO(log_text.encode("utf-8"))
+        # ログ保存などの重い処理はジョブキューに任せ、インタラクションにはすぐ応答する
+        payload = {
+            "case_id": self.CaseId,
+            "channel_id": interaction.channel.id,
+            "user_id": self.user_id,
+            "assignee_id": self.assignee_id,
+            "close_reason": close_reason,
+            "timestamp": datetime.datetime.utcnow().strftime("%Y%m%d%H%M%S"),
+            "close_time": datetime.datetime.now().isoformat(),
+        }
         try:
-            minio_client.put_object(
-                MINIO_BUCKET_NAME,
-                s3_filepath,
-                data=log_bytes,
-                length=log_bytes.getbuffer().nbytes,
-                content_type="text/plain"
-            )
+            job_id = await get_job_queue().enqueue(TICKET_CLOSE_JOB, payload, unique_key="case_id")
         except Exception as e:
-            await interaction.followup.send(f"❌ ログのアップロードに失敗しました: {e}", ephemeral=True)
+            error_content = f"❌ クローズ処理の登録に失敗しました: {e}"
+        else:
+            error_content = None if job_id else "⚠️ このチケットのクローズ処理は既に受け付けています。"
+        if error_content:
+            if interaction.response.is_done():
+                await interaction.followup.send(error_content, ephemeral=True)
+            else:
+                await interaction.response.send_message(error_content, ephemeral=True)
             return
 
-        # DBのステータスとソリューション、S3パスを更新
-        db_conn = get_db_connection()
-        cursor = db_conn.cursor()
-        close_time = datetime.datetime.now()
-        cursor.execute(
-            "UPDATE tickets SET status = 'closed', closed_at = %s, solution = %s, s3_filepath = %s WHERE CaseId = %s",
-            (close_time, close_reason, s3_filepath, self.CaseId)
-        )
-        db_conn.commit()
-        cursor.execute("SELECT id FROM tickets WHERE CaseId = %s", (self.CaseId,))
-        ticket_db_id = cursor.fetchone()[0]
-        cursor.close()
-        db_conn.close()
-
-        await interaction.response.send_message(
-            f"✅ **チケットはクローズされました。**\n<@{self.user_id}>さん、ご協力ありがとうございました。",
-            ephemeral=False
-        )
-
-        if attachment_upload_errors:
-            await channel.send(
-                content="⚠️ 一部の添付ファイルのアップロードに失敗しました：\n" + "\n".join(attachment_upload_errors)
-            )
-
-        # チャンネル上でアンケートを送信
-        survey_view = SurveyView(ticket_db_id=ticket_db_id, assignee_id=self.assignee_id, target_user_id=self.user_id, bot=self.bot)
-        await channel.send(
-            content=f"<@{self.user_id}>さん、今回のサポートについて簡単なアンケートにご協力ください。",
-            view=survey_view
-        )
-
-        # チャンネルをリネームし、7日後削除の案内を送信
-        await channel.edit(name=f"closed-{channel.name}")
-        await channel.send(f"**【ご案内】** このチャンネルは7日後（{ (close_time + datetime.timedelta(days=7)).strftime('%Y年%m月%d日頃')}）に自動的に削除されます。")
+        content = "⏳ **クローズ処理を受け付けました。**\nログの保存が完了すると、このチャンネルでお知らせします。"
+        if interaction.response.is_done():
+            await interaction.followup.send(content, ephemeral=False)
+        else:
+            await interaction.response.send_message(content, ephemeral=False)
 
         # ボタンを無効化
         for child in self.children:
@@ -264,6 +194,157 @@ class CloseConfirmView(View):
             return
         await interaction.response.edit_message(content="クローズ処理はキャンセルされました。", view=None)
 
+# --- チケットクローズのバックグラウンドジョブ ---
+TICKET_CLOSE_JOB = "ticket_close"
+
+def _mark_ticket_closed(db_conn, case_id, close_time, close_reason, s3_filepath):
+    cursor = db_conn.cursor()
+    cursor.execute(
+        "UPDATE tickets SET status = 'closed', closed_at = %s, solution = %s, s3_filepath = %s, manifest_key = %s "
+        "WHERE CaseId = %s",
+        (close_time, close_reason, s3_filepath, s3_filepath, case_id)
+    )
+    db_conn.commit()
+    cursor.execute("SELECT id FROM tickets WHERE CaseId = %s", (case_id,))
+    ticket_db_id = cursor.fetchone()[0]
+    cursor.close()
+    return ticket_db_id
+
+async def run_ticket_close_job(bot: commands.Bot, payload: dict):
+    """
+    クローズジョブ本体: ログと添付ファイルの保存、DB更新、アンケート送信、チャンネルのリネーム。
+    再試行時は、既にDBへ記録済みのログ保存をやり直さない。
+    チャンネルへの送信は完了した手順を payload["completed_steps"] に記録して保存し、
+    途中で失敗しても同じメッセージやアンケートを重複して送らない。
+    """
+    case_id = payload["case_id"]
+    channel = bot.get_channel(payload["channel_id"]) or await bot.fetch_channel(payload["channel_id"])
+    close_time = datetime.datetime.fromisoformat(payload["close_time"])
+    timestamp_str = payload["timestamp"]
+
+    # S3アップロード用ファイル名 (ログ本体はセグメント、ここに書くのはその索引となるマニフェスト)
+    s3_filepath = f"ticket_logs/{case_id}_{timestamp_str}.manifest.json"
+
+    ticket = await fetch_one("SELECT id, status, manifest_key, is_escalated FROM tickets WHERE CaseId = %s", (case_id,), dictionary=True)
+    job_queue = get_job_queue()
+    completed_steps = payload.setdefault("completed_steps", [])
+    if ticket and ticket["status"] in ("closed", "archived") and ticket["manifest_key"]:
+        if ticket["manifest_key"] != s3_filepath:
+            # 別のクローズ処理で既にクローズ済み。ログやクローズ理由を上書きせず、案内も重複して送らない
+            print(f"ℹ️ チケット {case_id} は既にクローズ済みのため、クローズジョブをスキップします。")
+            return
+        # このジョブの再試行: ログ保存とDB更新は済んでいるので、残りの手順だけを行う
+        ticket_db_id = ticket["id"]
+    else:
+        # 記録済みのセグメントを確定させ、マニフェストを書き出すだけで済ませる
+        capture = get_capture()
+        segments = await capture.seal(case_id)
+        if not segments:
+            # リアルタイム記録が無いチケット (記録開始前に作成されたもの等) は履歴から記録する
+            await capture.backfill(case_id, channel)
+            segments = await capture.seal(case_id)
+        manifest = build_manifest(case_id, segments)
+        await get_storage().put_bytes(
+            s3_filepath, json.dumps(manifest, ensure_ascii=False).encode("utf-8"), content_type="application/json"
+        )
+        payload["attachment_upload_errors"] = [
+            f"{att['filename']}: {att['error']}" for att in manifest["attachments"] if att.get("error")
+        ]
+        await job_queue.checkpoint(payload)
+
+        # DBのステータスとソリューション、S3パスを更新
+        ticket_db_id = await run_db(_mark_ticket_closed, case_id, close_time, payload["close_reason"], s3_filepath)
+
+    if "notified" not in completed_steps:
+        await channel.send(f"✅ **チケットはクローズされました。**\n<@{payload['user_id']}>さん、ご協力ありがとうございました。")
+        completed_steps.append("notified")
+        await job_queue.checkpoint(payload)
+
+    attachment_upload_errors = payload.get("attachment_upload_errors")
+    if attachment_upload_errors and "attachment_errors" not in completed_steps:
+        await channel.send(
+            content="⚠️ 一部の添付ファイルのアップロードに失敗しました：\n" + "\n".join(attachment_upload_errors)
+        )
+        completed_steps.append("attachment_errors")
+        await job_queue.checkpoint(payload)
+
+    # チャンネル上でアンケートを送信
+    if "survey" not in completed_steps:
+        survey_view = SurveyView(ticket_db_id=ticket_db_id, assignee_id=payload["assignee_id"], target_user_id=payload["user_id"], bot=bot)
+        await channel.send(
+            content=f"<@{payload['user_id']}>さん、今回のサポートについて簡単なアンケートにご協力ください。",
+            view=survey_view
+        )
+        completed_steps.append("survey")
+        await job_queue.checkpoint(payload)
+
+    # チャンネルをリネームし、7日後削除の案内を送信
+    if not channel.name.startswith("closed-"):
+        await channel.edit(name=f"closed-{channel.name}")
+    if "retention_notice" not in completed_steps:
+        await channel.send(f"**【ご案内】** このチャンネルは7日後（{ (close_time + datetime.timedelta(days=7)).strftime('%Y年%m月%d日頃')}）に自動的に削除されます。")
+        completed_steps.append("retention_notice")
+        await job_queue.checkpoint(payload)
+
+    # チャンネル (エスカレーションしていれば対応相談チャンネルも) の削除を予約
+    scheduler = get_scheduler()
+    scheduler.schedule(TICKET_CHANNEL_EXPIRY, case_id, close_time + CLOSED_CHANNEL_RETENTION)
+    if ticket and ticket["is_escalated"]:
+        scheduler.schedule(ESCALATION_CHANNEL_EXPIRY, case_id, close_time + CLOSED_CHANNEL_RETENTION)
+
+# クローズ後、チャンネルを削除するまでの日数
+CLOSED_CHANNEL_RETENTION = datetime.timedelta(days=7)
+
+async def load_ticket_channel_expiries() -> list:
+    """起動時に、クローズ済み (未削除) チケットのチャンネル削除期限を読み込む"""
+    rows = await fetch_all("SELECT CaseId, closed_at FROM tickets WHERE status = 'closed' AND closed_at IS NOT NULL")
+    return [(case_id, closed_at + CLOSED_CHANNEL_RETENTION) for case_id, closed_at in rows]
+
+async def delete_expired_ticket_channels(bot: commands.Bot, case_ids: list) -> list:
+    """期限を迎えたチケットのチャンネルを削除し、まとめて archived にする。削除できなかった CaseId を返す (再試行用)。"""
+    placeholders = ", ".join(["%s"] * len(case_ids))
+    old_tickets = await fetch_all(
+        f"SELECT channel_id, CaseId FROM tickets WHERE status = 'closed' AND CaseId IN ({placeholders})",
+        tuple(case_ids), dictionary=True
+    )
+    if not old_tickets:
+        return []
+
+    print(f"🧹 古いチケットチャンネルの削除を開始します。対象: {len(old_tickets)}件")
+    user_guild = bot.get_guild(USER_GUILD_ID)
+    if not user_guild:
+        raise RuntimeError("ユーザーギルドが見つかりません。")
+
+    archived = []
+    failed = []
+    for ticket in old_tickets:
+        try:
+            channel = user_guild.get_channel(ticket['channel_id'])
+            if channel:
+                await channel.delete(reason="クローズ後7日経過したため自動削除")
+                print(f"  - チャンネルを削除しました: {channel.name} (CaseID: {ticket['CaseId']})")
+            else:
+                print(f"  - チャンネルが見つかりませんでした (手動削除済みか？): ChannelID {ticket['channel_id']}")
+            archived.append(ticket['CaseId'])
+        except discord.NotFound:
+            # チャンネルが既に見つからない場合でも、ステータスは更新しておく
+            print(f"  - チャンネルが見つかりませんでした (手動削除済みか？): ChannelID {ticket['channel_id']}")
+            archived.append(ticket['CaseId'])
+        except discord.HTTPException as e:
+            print(f"  - チャンネルを削除できませんでした: ChannelID {ticket['channel_id']}: {e}")
+            failed.append(ticket['CaseId'])
+
+    # チャンネル削除後、DBのステータスをまとめて更新して再処理を防ぐ
+    if archived:
+        placeholders = ", ".join(["%s"] * len(archived))
+        await execute(f"UPDATE tickets SET status = 'archived' WHERE CaseId IN ({placeholders})", tuple(archived))
+    return failed
+
+async def notify_ticket_close_failed(bot: commands.Bot, payload: dict, error: str):
+    channel = bot.get_channel(payload["channel_id"])
+    if channel:
+        await channel.send(f"❌ チケットのクローズ処理に失敗しました。管理者に連絡してください。\n`{error}`")
+
 # --- コマンド本体 ---
 async def setup(bot: commands.Bot):
     # (永続ビューの登録は変更なし)
@@ -271,62 +352,23 @@ async def setup(bot: commands.Bot):
         bot.add_view(SurveyView(ticket_db_id=None, assignee_id=None, target_user_id=None, bot=bot))
         bot._added_survey_view = True
 
+    # クローズ処理のジョブハンドラを登録 (ワーカーは main.py の on_ready で起動される)
+    async def handle_ticket_close(payload: dict):
+        await run_ticket_close_job(bot, payload)
+
+    async def handle_ticket_close_failed(payload: dict, error: str):
+        await notify_ticket_close_failed(bot, payload, error)
+
+    get_job_queue().register(TICKET_CLOSE_JOB, handle_ticket_close, on_failure=handle_ticket_close_failed)
+
     # ▼▼▼ 新規追加 ▼▼▼
     # --------------------------------------------------------------------------------
-    # 3. 7日経過したクローズ済みチャンネルを削除するバックグラウンドタスク
+    # 3. クローズから7日経過したチャンネルの削除 (scheduler.py が期限ちょうどに呼び出す)
     # --------------------------------------------------------------------------------
-    @tasks.loop(hours=1.0) # 1時間ごとに実行
-    async def delete_old_closed_channels():
-        try:
-            db_conn = get_db_connection()
-            cursor = db_conn.cursor(dictionary=True)
-            
-            # クローズされてから7日以上経過したチケットを取得
-            query = "SELECT channel_id, CaseId FROM tickets WHERE status = 'closed' AND closed_at IS NOT NULL AND closed_at < NOW() - INTERVAL 7 DAY"
-            cursor.execute(query)
-            old_tickets = cursor.fetchall()
-            
-            if not old_tickets:
-                return # 対象がなければ何もしない
-
-            print(f"🧹 古いチケットチャンネルの削除を開始します。対象: {len(old_tickets)}件")
-            user_guild = bot.get_guild(USER_GUILD_ID)
-            if not user_guild: return
-
-            for ticket in old_tickets:
-                try:
-                    channel = user_guild.get_channel(ticket['channel_id'])
-                    if channel:
-                        await channel.delete(reason="クローズ後7日経過したため自動削除")
-                        print(f"  - チャンネルを削除しました: {channel.name} (CaseID: {ticket['CaseId']})")
-
-                    # チャンネル削除後、DBのステータスを更新して再処理を防ぐ
-                    update_query = "UPDATE tickets SET status = 'archived' WHERE channel_id = %s"
-                    cursor.execute(update_query, (ticket['channel_id'],))
-                    db_conn.commit()
-
-                except discord.NotFound:
-                    # チャンネルが既に見つからない場合でも、ステータスは更新しておく
-                    print(f"  - チャンネルが見つかりませんでした (手動削除済みか？): ChannelID {ticket['channel_id']}")
-                    update_query = "UPDATE tickets SET status = 'archived' WHERE channel_id = %s"
-                    cursor.execute(update_query, (ticket['channel_id'],))
-                    db_conn.commit()
-                except discord.Forbidden:
-                    print(f"  - 権限エラー: チャンネルを削除できませんでした: ChannelID {ticket['channel_id']}")
-                except Exception as e:
-                    print(f"  - 不明なエラー: {e}")
-
-            cursor.close()
-            db_conn.close()
-
-        except Exception as e:
-            print(f"❌ チャンネル削除タスクでエラーが発生しました: {e}")
+    async def handle_ticket_channel_expiry(case_ids: list):
+        return await delete_expired_ticket_channels(bot, case_ids)
 
-    # Bot起動時にタスクを開始するためのリスナー
-    @bot.listen('on_ready')
-    async def start_cleanup_task():
-        if not delete_old_closed_channels.is_running():
-            delete_old_closed_channels.start()
+    get_scheduler().register(TICKET_CHANNEL_EXPIRY, handle_ticket_channel_expiry, loader=load_ticket_channel_expiries)
 
     # (closeコマンド本体は変更なし)
     @app_commands.command(name="close", description="このチケットをクローズします。")
@@ -341,8 +383,7 @@ async def setup(bot: commands.Bot):
             if not (len(CaseId) == 12 and CaseId.isdigit()): raise ValueError
         except (IndexError, ValueError):
             await interaction.response.send_message("❌ このチャンネルは有効なチケットチャンネルではないようです。", ephemeral=True); return
-        db_conn = get_db_connection(); cursor = db_conn.cursor(dictionary=True)
-        cursor.execute("SELECT user_id, assigned_to FROM tickets WHERE CaseId = %s", (CaseId,)); ticket = cursor.fetchone(); cursor.close(); db_conn.close()
+        ticket = await fetch_one("SELECT user_id, assigned_to FROM tickets WHERE CaseId = %s", (CaseId,), dictionary=True)
         if not ticket: await interaction.response.send_message("❌ チケット情報がDBに見つかりません。", ephemeral=True); return
         if interaction.user.id not in [ticket['user_id'], ticket['assigned_to']]:
             await interaction.response.send_message("❌ このコマンドは、チケットの起票者または担当者のみ実行できます。", ephemeral=True); return
@@ -1,20 +1,46 @@
+# PrivateChannel.status_code: 0 = 申請中, 1 = 利用中, 2 = 削除済み, 3 = 延長により置き換え済み
+# 作成したチャンネルの ID を channel_id に保存し、削除・延長時は名前ではなく ID で参照する。
+#
+#   ALTER TABLE PrivateChannel ADD COLUMN channel_id BIGINT NULL;
+
 import discord
-import mysql.connector
 from discord import app_commands, Interaction
 from discord.ext import commands
-from discord.ext import tasks
 import datetime
 from discord.ui import Modal, TextInput, Button, View
 from discord import TextStyle, Object
 from config import *
-
-def get_db_connection():
-    return mysql.connector.connect(
-        host=DB_HOST,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME
+from db import fetch_all, fetch_one, execute, insert, run_db
+from scheduler import get_scheduler, PRIVATE_CHANNEL_EXPIRY
+from guild_index import get_guild_index
+
+async def load_private_channel_expiries() -> list:
+    """起動時に、承認済みプライベートチャンネルの有効期限を読み込む"""
+    return await fetch_all("SELECT id, close_date FROM PrivateChannel WHERE status_code = 1 AND close_date IS NOT NULL")
+
+async def schedule_private_channel_expiry(request_id: int):
+    """承認・延長した申請の有効期限でチャンネルの削除を予約する"""
+    row = await fetch_one("SELECT close_date FROM PrivateChannel WHERE id=%s AND status_code=1", (request_id,))
+    if row:
+        get_scheduler().schedule(PRIVATE_CHANNEL_EXPIRY, request_id, row[0])
+
+def _approve_extension(db_conn, request_id: int, approver_id: int):
+    """延長申請を承認し、同じチャンネルの以前の申請を置き換え済み (3) にする"""
+    cursor = db_conn.cursor()
+    cursor.execute(
+        "UPDATE PrivateChannel SET status_code=%s, approve_date=NOW(), close_date=DATE_ADD(NOW(), INTERVAL 35 DAY), approver=%s, extend_count = extend_count + 1 WHERE id=%s",
+        (1, approver_id, request_id)
+    )
+    cursor.execute("SELECT channel_id, channel_name, requestor FROM PrivateChannel WHERE id=%s", (request_id,))
+    channel_id, channel_name, requestor = cursor.fetchone()
+    cursor.execute(
+        "UPDATE PrivateChannel SET status_code = 3 "
+        "WHERE id < %s AND status_code = 1 AND requestor = %s "
+        "AND (channel_id = %s OR (channel_id IS NULL AND channel_name = %s))",
+        (request_id, requestor, channel_id, channel_name)
     )
+    db_conn.commit()
+    cursor.close()
 
 class PrivChannelRequestModal(Modal, title="プライベートチャンネル申請"):
     def __init__(self, bot: commands.Bot, user: discord.User):
@@ -40,15 +66,10 @@ class PrivChannelRequestModal(Modal, title="プライベートチャンネル申
 
     async def on_submit(self, interaction: Interaction):
         # Insert request into DB
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
+        request_id = await insert(
             "INSERT INTO PrivateChannel (channel_name, channle_description, status_code, requestor) VALUES (%s, %s, %s, %s)",
             (self.channel_title.value, self.channel_content.value, 0, self.requester.id)
         )
-        conn.commit()
-        cursor.close()
-        conn.close()
 
         admin_guild = self.bot.get_guild(ADMIN_GUILD_ID)
         category = admin_guild.get_channel(ADMIN_REQUEST_CATEGORY_ID)
@@ -77,7 +98,8 @@ class PrivChannelRequestModal(Modal, title="プライベートチャンネル申
             title=self.channel_title.value,
             content=self.channel_content.value,
             requester=self.requester,
-            channel_request=channel
+            channel_request=channel,
+            request_id=request_id
         )
 
         await channel.send(embed=embed, view=view)
@@ -85,9 +107,10 @@ class PrivChannelRequestModal(Modal, title="プライベートチャンネル申
 
 
 class PrivChannelApprovalView(View):
-    def __init__(self, bot: commands.Bot, title: str, content: str, requester: discord.User, channel_request: discord.TextChannel, is_extension: bool = False):
+    def __init__(self, bot: commands.Bot, title: str, content: str, requester: discord.User, channel_request: discord.TextChannel, request_id: int, is_extension: bool = False):
         super().__init__(timeout=None)
         self.bot = bot
+        self.request_id = request_id
         self.title = title
         self.content = content
         self.requester = requester
@@ -98,15 +121,8 @@ class PrivChannelApprovalView(View):
     async def approve(self, interaction: Interaction, button: Button):
         if self.is_extension:
             # 延長処理：チャネル作成せず、終了日を延長
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE PrivateChannel SET status_code=%s, approve_date=NOW(), close_date=DATE_ADD(NOW(), INTERVAL 35 DAY), approver=%s, extend_count = extend_count + 1 WHERE channel_name=%s AND requestor=%s ORDER BY id DESC LIMIT 1",
-                (1, interaction.user.id, self.title, self.requester.id)
-            )
-            conn.commit()
-            cursor.close()
-            conn.close()
+            await run_db(_approve_extension, self.request_id, interaction.user.id)
+            await schedule_private_channel_expiry(self.request_id)
             valid_until = (datetime.datetime.now() + datetime.timedelta(days=30)).strftime("%Y-%m-%d")
             await interaction.response.send_message(f"✅ 承認され、有効期限が延長されました。有効期限は {valid_until} までです。", ephemeral=True)
             await self.channel_request.delete()
@@ -129,15 +145,11 @@ class PrivChannelApprovalView(View):
         )
 
         # Update DB record for approval
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE PrivateChannel SET status_code=%s, approve_date=NOW(), close_date=DATE_ADD(NOW(), INTERVAL 35 DAY), approver=%s WHERE channel_name=%s AND requestor=%s ORDER BY id DESC LIMIT 1",
-            (1, interaction.user.id, self.title, self.requester.id)
+        await execute(
+            "UPDATE PrivateChannel SET status_code=%s, approve_date=NOW(), close_date=DATE_ADD(NOW(), INTERVAL 35 DAY), approver=%s, channel_id=%s WHERE id=%s",
+            (1, interaction.user.id, new_channel.id, self.request_id)
         )
-        conn.commit()
-        cursor.close()
-        conn.close()
+        await schedule_private_channel_expiry(self.request_id)
 
         valid_until = (datetime.datetime.now() + datetime.timedelta(days=30)).strftime("%Y-%m-%d")
         await interaction.response.send_message("✅ 承認され、チャンネルを作成しました。", ephemeral=True)
@@ -155,66 +167,67 @@ class PrivChannelApprovalView(View):
 
 
 class PrivateChannelCog(commands.Cog):
-    def cog_load(self):
-        self.cleanup_expired_channels.start()
-
-    @tasks.loop(hours=24)
-    async def cleanup_expired_channels(self):
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT channel_name FROM PrivateChannel WHERE close_date < NOW() AND status_code = 1"
+    # 有効期限切れのチャンネルの削除 (scheduler.py が期限ちょうどに呼び出す)
+    async def delete_expired_channels(self, request_ids: list) -> list:
+        """期限を迎えたプライベートチャンネルを削除する。削除できなかった申請IDを返す (再試行用)。"""
+        placeholders = ", ".join(["%s"] * len(request_ids))
+        expired_channels = await fetch_all(
+            f"SELECT id, channel_id, channel_name FROM PrivateChannel WHERE id IN ({placeholders}) AND close_date <= NOW() AND status_code = 1",
+            tuple(request_ids)
         )
-        expired_channels = cursor.fetchall()
-        cursor.close()
-        conn.close()
 
         if not expired_channels:
-            return
+            return []
 
         guild = self.bot.get_guild(USER_GUILD_ID)
-        for (channel_name,) in expired_channels:
-            channel = discord.utils.get(guild.text_channels, name=channel_name)
-            if channel:
-                try:
+        if not guild:
+            raise RuntimeError("ユーザーギルドが見つかりません。")
+        index = get_guild_index()
+        deleted = []
+        failed = []
+        for request_id, channel_id, channel_name in expired_channels:
+            if channel_id:
+                channel = guild.get_channel(channel_id)
+            else:
+                channel = index.text_channel(guild, channel_name)  # ID 保存前に作成されたチャンネル
+            try:
+                if channel:
                     await channel.delete(reason="自動削除: 有効期限切れ")
-                except discord.HTTPException:
-                    pass
-
-    def cog_unload(self):
-        self.cleanup_expired_channels.cancel()
+                deleted.append(request_id)
+            except discord.NotFound:
+                deleted.append(request_id)
+            except discord.HTTPException as e:
+                print(f"  - プライベートチャンネルを削除できませんでした: {channel_name} (申請ID: {request_id}): {e}")
+                failed.append(request_id)
+
+        # 削除済み (2) にまとめて更新し、以降の読み込み対象から外す
+        if deleted:
+            placeholders = ", ".join(["%s"] * len(deleted))
+            await execute(f"UPDATE PrivateChannel SET status_code = 2 WHERE id IN ({placeholders})", tuple(deleted))
+        return failed
 
     @app_commands.command(name="extend", description="プライベートチャネルの継続利用申請を行います")
     @app_commands.guilds(Object(id=USER_GUILD_ID))
     async def extend_priv_channel(self, interaction: Interaction):
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT id, close_date, extend_count FROM PrivateChannel WHERE channel_name=%s AND requestor=%s ORDER BY id DESC LIMIT 1",
-            (interaction.channel.name, interaction.user.id)
+        row = await fetch_one(
+            "SELECT id, close_date, extend_count FROM PrivateChannel "
+            "WHERE (channel_id=%s OR (channel_id IS NULL AND channel_name=%s)) AND requestor=%s AND status_code=1 ORDER BY id DESC LIMIT 1",
+            (interaction.channel.id, interaction.channel.name, interaction.user.id)
         )
-        row = cursor.fetchone()
         if not row:
             await interaction.response.send_message("❌ 申請記録が見つかりません。", ephemeral=True)
-            cursor.close()
-            conn.close()
             return
 
         request_id, close_date, extend_count = row
         if (close_date - datetime.datetime.now()).days > 20:
             await interaction.response.send_message("❌ 有効期限の15日前以降でないと延長申請はできません。", ephemeral=True)
-            cursor.close()
-            conn.close()
             return
 
-        cursor.execute(
-            "INSERT INTO PrivateChannel (channel_name, channle_description, status_code, requestor) "
-            "SELECT channel_name, channle_description, 0, requestor FROM PrivateChannel WHERE id=%s",
-            (request_id,)
+        extension_id = await insert(
+            "INSERT INTO PrivateChannel (channel_name, channle_description, status_code, requestor, channel_id) "
+            "SELECT channel_name, channle_description, 0, requestor, %s FROM PrivateChannel WHERE id=%s",
+            (interaction.channel.id, request_id)
         )
-        conn.commit()
-        cursor.close()
-        conn.close()
 
         admin_guild = self.bot.get_guild(ADMIN_GUILD_ID)
         category = admin_guild.get_channel(ADMIN_REQUEST_CATEGORY_ID)
@@ -242,6 +255,7 @@ class PrivateChannelCog(commands.Cog):
             content="延長申請",
             requester=interaction.user,
             channel_request=channel,
+            request_id=extension_id,
             is_extension=True
         )
         await channel.send(embed=embed, view=view)
@@ -258,5 +272,6 @@ class PrivateChannelCog(commands.Cog):
 async def setup(bot):
     cog = PrivateChannelCog(bot)
     await bot.add_cog(cog)
+    get_scheduler().register(PRIVATE_CHANNEL_EXPIRY, cog.delete_expired_channels, loader=load_private_channel_expiries)
     # Add extend_priv_channel command to the tree
     #cog.bot.tree.add_command(cog.extend_priv_channel)
\ No newline at end of file
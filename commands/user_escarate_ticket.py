@@ -1,14 +1,17 @@
+# 対応相談チャンネルは作成時に ID を tickets に保存し、削除時は名前ではなく ID で参照する。
+# 削除済みは escalation_channel_id = 0 (終端状態) とし、以降は読み込まない (NULL は ID 保存前に作成されたもの)。
+#
+#   ALTER TABLE tickets ADD COLUMN escalation_channel_id BIGINT NULL;
+
 import discord
 from discord import app_commands, Interaction, Object, TextStyle
-from discord.ext import commands, tasks
+from discord.ext import commands
 from discord.ui import Modal, TextInput
-from discord.utils import get
-from datetime import datetime, timedelta
+from datetime import timedelta
 from config import *
-import mysql.connector
-
-def get_db_connection():
-    return mysql.connector.connect(host=DB_HOST, user=DB_USER, password=DB_PASSWORD, database=DB_NAME)
+from db import fetch_one, fetch_all, execute
+from scheduler import get_scheduler, ESCALATION_CHANNEL_EXPIRY
+from guild_index import get_guild_index
 
 class EscalationReasonModal(Modal, title="エスカレーション理由の入力"):
     def __init__(self, case_id, category, content, assignee_id, bot):
@@ -32,12 +35,7 @@ class EscalationReasonModal(Modal, title="エスカレーション理由の入
         await interaction.response.defer(ephemeral=True)
 
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("UPDATE tickets SET is_escalated = 1 WHERE CaseId = %s", (self.case_id,))
-            conn.commit()
-            cursor.close()
-            conn.close()
+            await execute("UPDATE tickets SET is_escalated = 1 WHERE CaseId = %s", (self.case_id,))
         except Exception as e:
             await interaction.followup.send(f"DB更新中にエラーが発生しました: {e}", ephemeral=True)
             return
@@ -64,7 +62,6 @@ class EscalationReasonModal(Modal, title="エスカレーション理由の入
 class Escalation(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.cleanup_escalated_channels.start()
 
     @app_commands.command(name="escalate", description="チケットを管理者にエスカレーションします。")
     @app_commands.guilds(Object(id=USER_GUILD_ID))
@@ -74,12 +71,7 @@ class Escalation(commands.Cog):
             return
 
         case_id = interaction.channel.name.split("-")[0]
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM tickets WHERE CaseId = %s", (case_id,))
-        ticket = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        ticket = await fetch_one("SELECT * FROM tickets WHERE CaseId = %s", (case_id,), dictionary=True)
 
         if not ticket:
             await interaction.response.send_message("チケット情報が見つかりません。", ephemeral=True)
@@ -112,7 +104,7 @@ class Escalation(commands.Cog):
                 if case_id_field:
                     case_id = case_id_field.value
                     guild = reaction.message.guild
-                    existing = discord.utils.get(guild.text_channels, name=f"対応相談-{case_id}")
+                    existing = get_guild_index().text_channel(guild, f"対応相談-{case_id}")
                     if existing:
                         return
                     category = guild.get_channel(ESCALATION_CATEGORY_ID)
@@ -120,38 +112,63 @@ class Escalation(commands.Cog):
                         guild.default_role: discord.PermissionOverwrite(read_messages=False),
                         user: discord.PermissionOverwrite(read_messages=True, send_messages=True),
                     }
-                    await guild.create_text_channel(
+                    channel = await guild.create_text_channel(
                         name=f"対応相談-{case_id}",
                         category=category,
                         overwrites=overwrites,
                         reason="エスカレーションに伴う対応相談"
                     )
+                    await execute("UPDATE tickets SET escalation_channel_id = %s WHERE CaseId = %s", (channel.id, case_id))
 
-    @tasks.loop(hours=1)
-    async def cleanup_escalated_channels(self):
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(
-            "SELECT CaseId, channel_id, closed_at FROM tickets WHERE is_escalated = 1 AND status IN ('closed', 'archived') AND closed_at < NOW() - INTERVAL 7 DAY"
-        )
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-
+    # クローズから7日経過した対応相談チャンネルの削除 (scheduler.py が期限ちょうどに呼び出す)
+    async def delete_escalated_channels(self, case_ids: list) -> list:
+        """期限を迎えた対応相談チャンネルを削除する。削除できなかった CaseId を返す (再試行用)。"""
         admin_guild = self.bot.get_guild(ADMIN_GUILD_ID)
         if not admin_guild:
-            return
+            raise RuntimeError("管理ギルドが見つかりません。")
 
-        for row in rows:
-            ch_name = f"対応相談-{row['CaseId']}"
-            ch = discord.utils.get(admin_guild.text_channels, name=ch_name)
-            if ch:
-                await ch.delete(reason="クローズ後7日経過したため自動削除")
+        placeholders = ", ".join(["%s"] * len(case_ids))
+        rows = await fetch_all(
+            f"SELECT CaseId, escalation_channel_id FROM tickets WHERE CaseId IN ({placeholders}) "
+            f"AND (escalation_channel_id IS NULL OR escalation_channel_id <> 0)",
+            tuple(case_ids)
+        )
 
-    @cleanup_escalated_channels.before_loop
-    async def before_cleanup(self):
-        await self.bot.wait_until_ready()
+        index = get_guild_index()
+        deleted = []
+        failed = []
+        for case_id, channel_id in rows:
+            if channel_id:
+                ch = admin_guild.get_channel(channel_id)
+            else:
+                ch = index.text_channel(admin_guild, f"対応相談-{case_id}")  # ID 保存前に作成されたチャンネル
+            try:
+                if ch:
+                    await ch.delete(reason="クローズ後7日経過したため自動削除")
+                deleted.append(case_id)
+            except discord.NotFound:
+                deleted.append(case_id)
+            except discord.HTTPException as e:
+                print(f"  - 対応相談チャンネルを削除できませんでした: CaseID {case_id}: {e}")
+                failed.append(case_id)
+
+        # 削除済みとしてまとめて記録し、以降の読み込み対象から外す
+        if deleted:
+            placeholders = ", ".join(["%s"] * len(deleted))
+            await execute(f"UPDATE tickets SET escalation_channel_id = 0 WHERE CaseId IN ({placeholders})", tuple(deleted))
+        return failed
+
+
+async def load_escalation_channel_expiries() -> list:
+    """起動時に、エスカレーションしたクローズ済みチケットの対応相談チャンネル削除期限を読み込む"""
+    rows = await fetch_all(
+        "SELECT CaseId, closed_at FROM tickets WHERE is_escalated = 1 AND status IN ('closed', 'archived') AND closed_at IS NOT NULL "
+        "AND (escalation_channel_id IS NULL OR escalation_channel_id <> 0)"
+    )
+    return [(case_id, closed_at + timedelta(days=7)) for case_id, closed_at in rows]
 
 
 async def setup(bot):
-    await bot.add_cog(Escalation(bot))
\ No newline at end of file
+    cog = Escalation(bot)
+    await bot.add_cog(cog)
+    get_scheduler().register(ESCALATION_CHANNEL_EXPIRY, cog.delete_escalated_channels, loader=load_escalation_channel_expiries)
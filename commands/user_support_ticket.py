@@ -5,18 +5,15 @@ import discord
 from discord import app_commands, Interaction, Member, Role, SelectOption, TextStyle, Object, PermissionOverwrite, CategoryChannel
 from discord.ext import commands
 from discord.ui import Modal, TextInput, View, Select
-import mysql.connector
 import datetime
 import random
 
 # configから設定値を読み込み
 from config import (
     USER_GUILD_ID, ADMIN_GUILD_ID, ADMIN_NOTIFY_CHANNEL_ID,
-    TICKET_CATEGORY_ID, STAFF_ROLE_ID, DB_HOST, DB_USER, DB_PASSWORD, DB_NAME
+    TICKET_CATEGORY_ID, STAFF_ROLE_ID
 )
-
-def get_db_connection():
-    return mysql.connector.connect(host=DB_HOST, user=DB_USER, password=DB_PASSWORD, database=DB_NAME)
+from db import fetch_one, execute, run_db
 
 # 担当者アサインの共通処理
 async def handle_ticket_assignment(message: discord.Message, staff_member: discord.Member, bot: commands.Bot):
@@ -30,15 +27,12 @@ async def handle_ticket_assignment(message: discord.Message, staff_member: disco
         
         # ▼▼▼ 修正 ▼▼▼
         # 担当者IDとステータスをDBに保存
-        db_conn = get_db_connection(); cursor = db_conn.cursor()
         sql = "UPDATE tickets SET assigned_to = %s, status = 'assigned' WHERE CaseId = %s"
         # ▲▲▲ 修正 ▲▲▲
         val = (staff_member.id, ticket_db_id)
-        cursor.execute(sql, val)
-        db_conn.commit()
-        
-        cursor.execute("SELECT channel_id FROM tickets WHERE CaseId = %s", (ticket_db_id,)); result = cursor.fetchone()
-        cursor.close(); db_conn.close()
+        await execute(sql, val)
+
+        result = await fetch_one("SELECT channel_id FROM tickets WHERE CaseId = %s", (ticket_db_id,))
 
         if not result: return
         channel_id = result[0]
@@ -84,28 +78,8 @@ class TicketContentModal(Modal):
         await interaction.response.defer(ephemeral=True)
 
         try:
-            db_conn = get_db_connection()
-            cursor = db_conn.cursor()
-            
-            # 1. 重複しないCaseIDを生成
-            while True:
-                now = datetime.datetime.now()
-                case_id_variable = f"{now.strftime('%y%m%d')}{random.randint(100000, 999999)}"
-                # ▼▼▼ 修正 ▼▼▼
-                cursor.execute("SELECT id FROM tickets WHERE CaseId = %s", (case_id_variable,))
-                # ▲▲▲ 修正 ▲▲▲
-                if not cursor.fetchone():
-                    break
-            
-            # 2. データベースにチケット情報を保存
-            # ▼▼▼ 修正 ▼▼▼
-            sql = "INSERT INTO tickets (user_id, guild_id, category, content, CaseId) VALUES (%s, %s, %s, %s, %s)"
-            # ▲▲▲ 修正 ▲▲▲
-            val = (interaction.user.id, interaction.guild.id, self.category, self.content.value, case_id_variable)
-            cursor.execute(sql, val)
-            db_conn.commit()
-            
-            ticket_db_id = cursor.lastrowid
+            # 1. 重複しないCaseIDを生成し、2. データベースにチケット情報を保存
+            case_id_variable, ticket_db_id = await run_db(self._insert_ticket, interaction.user.id, interaction.guild.id)
 
             # 3. プライベートチャンネルを作成
             parent_category = interaction.guild.get_channel(TICKET_CATEGORY_ID)
@@ -126,10 +100,7 @@ class TicketContentModal(Modal):
                 topic=f"Ticket for {interaction.user} (ID: {interaction.user.id}) | Case ID: {case_id_variable}"
             )
             
-            cursor.execute("UPDATE tickets SET channel_id = %s WHERE id = %s", (ticket_channel.id, ticket_db_id))
-            db_conn.commit()
-            cursor.close()
-            db_conn.close()
+            await execute("UPDATE tickets SET channel_id = %s WHERE id = %s", (ticket_channel.id, ticket_db_id))
 
             # 4. 管理者サーバーに通知を送信
             admin_guild = interaction.client.get_guild(ADMIN_GUILD_ID)
@@ -160,6 +131,25 @@ class TicketContentModal(Modal):
         except Exception as e:
             print(f"An error occurred in TicketContentModal: {e}"); await interaction.followup.send(f"❌ エラーが発生しました。管理者に連絡してください。\n`{e}`", ephemeral=True)
 
+    def _insert_ticket(self, db_conn, user_id: int, guild_id: int):
+        cursor = db_conn.cursor()
+        # 重複しないCaseIDを生成
+        while True:
+            now = datetime.datetime.now()
+            case_id_variable = f"{now.strftime('%y%m%d')}{random.randint(100000, 999999)}"
+            cursor.execute("SELECT id FROM tickets WHERE CaseId = %s", (case_id_variable,))
+            if not cursor.fetchone():
+                break
+
+        # データベースにチケット情報を保存
+        sql = "INSERT INTO tickets (user_id, guild_id, category, content, CaseId) VALUES (%s, %s, %s, %s, %s)"
+        val = (user_id, guild_id, self.category, self.content.value, case_id_variable)
+        cursor.execute(sql, val)
+        db_conn.commit()
+        ticket_db_id = cursor.lastrowid
+        cursor.close()
+        return case_id_variable, ticket_db_id
+
 # (ViolationConfirmView, TicketCategorySelect, TicketCreationView は変更なし)
 class ViolationConfirmView(View):
     def __init__(self): super().__init__(timeout=180)
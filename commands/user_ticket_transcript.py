@@ -0,0 +1,79 @@
+# commands/user_ticket_transcript.py (チケットログのリアルタイム記録)
+
+import discord
+from discord.ext import commands, tasks
+
+from config import USER_GUILD_ID, TICKET_CATEGORY_ID, TRANSCRIPT_FLUSH_INTERVAL
+from transcript import get_capture, parse_case_id, edit_entry, delete_entry
+
+
+async def setup(bot: commands.Bot):
+    capture = get_capture()
+
+    async def record(case_id: str, entry: dict):
+        # バッファが上限を超えたら定期書き出しを待たずにセグメント化する
+        if capture.record(case_id, entry):
+            try:
+                await capture.flush(case_id)
+            except Exception as e:
+                print(f"❌ ログセグメントの書き出しに失敗しました (CaseID: {case_id}): {e}")
+
+    # --- 一定間隔でバッファをセグメントとして書き出す ---
+    @tasks.loop(seconds=TRANSCRIPT_FLUSH_INTERVAL)
+    async def flush_transcripts():
+        await capture.flush_all()
+
+    # --- 投稿・編集・削除の記録 ---
+    @bot.listen('on_message')
+    async def capture_ticket_message(message: discord.Message):
+        case_id = parse_case_id(message.channel)
+        if not case_id:
+            return
+        try:
+            await capture.capture_message(case_id, message)
+        except Exception as e:
+            print(f"❌ ログセグメントの書き出しに失敗しました (CaseID: {case_id}): {e}")
+
+    @bot.listen('on_raw_message_edit')
+    async def capture_ticket_message_edit(payload: discord.RawMessageUpdateEvent):
+        channel = bot.get_channel(payload.channel_id)
+        case_id = parse_case_id(channel)
+        if not case_id:
+            return
+        entry = edit_entry(channel, payload.data)
+        if entry:
+            await record(case_id, entry)
+
+    @bot.listen('on_raw_message_delete')
+    async def capture_ticket_message_delete(payload: discord.RawMessageDeleteEvent):
+        case_id = parse_case_id(bot.get_channel(payload.channel_id))
+        if case_id:
+            await record(case_id, delete_entry(payload.message_id, payload.cached_message))
+
+    # --- 起動時: 定期書き出しを開始し、停止中に投稿されたメッセージを補完する ---
+    @bot.listen('on_ready')
+    async def start_transcript_capture():
+        if not flush_transcripts.is_running():
+            flush_transcripts.start()
+        if hasattr(bot, '_transcript_backfill_done'):
+            return
+        bot._transcript_backfill_done = True
+
+        guild = bot.get_guild(USER_GUILD_ID)
+        category = guild.get_channel(TICKET_CATEGORY_ID) if guild else None
+        if not isinstance(category, discord.CategoryChannel):
+            return
+        try:
+            last_ids = await capture.last_captured_message_ids()
+        except Exception as e:
+            print(f"❌ チケットログの補完に失敗しました: {e}")
+            return
+
+        for channel in category.text_channels:
+            case_id = parse_case_id(channel)
+            if not case_id:
+                continue
+            try:
+                await capture.backfill(case_id, channel, after=last_ids.get(case_id))
+            except Exception as e:
+                print(f"❌ チケットログの補完に失敗しました (CaseID: {case_id}): {e}")
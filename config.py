@@ -13,13 +13,71 @@ DB_HOST = os.getenv("DB_HOST")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL", "300"))
+DB_MAX_CONCURRENCY = int(os.getenv("DB_MAX_CONCURRENCY", str(DB_POOL_SIZE)))
 MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT")
 MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY")
 MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY")
 MINIO_BUCKET_NAME = os.getenv("MINIO_BUCKET_NAME")
 MINIO_USE_SSL = os.getenv("MINIO_USE_SSL", "true").lower()
+MINIO_PART_SIZE = int(os.getenv("MINIO_PART_SIZE", str(8 * 1024 * 1024)))
+STORAGE_MAX_WORKERS = int(os.getenv("STORAGE_MAX_WORKERS", "8"))
+STORAGE_MAX_UPLOADS = int(os.getenv("STORAGE_MAX_UPLOADS", "4"))
+STORAGE_MAX_CONNECTIONS = int(os.getenv("STORAGE_MAX_CONNECTIONS", str(STORAGE_MAX_WORKERS + STORAGE_MAX_UPLOADS)))
+ATTACHMENT_ARCHIVE_CONCURRENCY = int(os.getenv("ATTACHMENT_ARCHIVE_CONCURRENCY", "4"))
+TRANSCRIPT_FLUSH_INTERVAL = float(os.getenv("TRANSCRIPT_FLUSH_INTERVAL", "30"))
+TRANSCRIPT_SEGMENT_MAX_BYTES = int(os.getenv("TRANSCRIPT_SEGMENT_MAX_BYTES", str(256 * 1024)))
+BUNDLE_FETCH_CONCURRENCY = int(os.getenv("BUNDLE_FETCH_CONCURRENCY", "4"))
+BUNDLE_SPOOL_MAX_MEMORY = int(os.getenv("BUNDLE_SPOOL_MAX_MEMORY", str(16 * 1024 * 1024)))
+BUNDLE_URL_EXPIRY = int(os.getenv("BUNDLE_URL_EXPIRY", "3600"))
+BUNDLE_CACHE_DIR = os.getenv("BUNDLE_CACHE_DIR", "cache/bundles")
+BUNDLE_CACHE_MAX_BYTES = int(os.getenv("BUNDLE_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
 ESCALATION_NOTIFICATION_CHANNEL_ID = int(os.getenv("ESCALATION_NOTIFICATION_CHANNEL_ID"))
 ESCALATION_CATEGORY_ID = int(os.getenv("ESCALATION_CATEGORY_ID"))
 LEGAL_RESPONSE_CHANNEL_ID = int(os.getenv("LEGAL_RESPONSE_CHANNEL_ID"))
 USER_PRIVATE_CATEGORY_ID = int(os.getenv("USER_PRIVATE_CATEGORY_ID"))
-ADMIN_REQUEST_CATEGORY_ID = int(os.getenv("ADMIN_REQUEST_CATEGORY_ID"))
\ No newline at end of file
+ADMIN_REQUEST_CATEGORY_ID = int(os.getenv("ADMIN_REQUEST_CATEGORY_ID"))
+
+# ロール自動同期: SupportUsers 名簿キャッシュの有効期間 (秒)
+ROLE_ROSTER_TTL = float(os.getenv("ROLE_ROSTER_TTL", "60"))
+ROLE_SYNC_CONCURRENCY = int(os.getenv("ROLE_SYNC_CONCURRENCY", "5"))
+ROLE_SYNC_PROGRESS_INTERVAL = float(os.getenv("ROLE_SYNC_PROGRESS_INTERVAL", "5"))
+
+# バックグラウンドジョブキュー (チケットクローズ処理など)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_DELAY = float(os.getenv("JOB_RETRY_BASE_DELAY", "30"))
+JOB_RETRY_MAX_DELAY = float(os.getenv("JOB_RETRY_MAX_DELAY", "1800"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "30"))
+BULK_EXPORT_CONCURRENCY = int(os.getenv("BULK_EXPORT_CONCURRENCY", "1"))
+
+# 期限付き処理のスケジューラ設定
+SCHEDULER_RETRY_DELAY = float(os.getenv("SCHEDULER_RETRY_DELAY", "300"))
+SCHEDULER_MAX_SLEEP = float(os.getenv("SCHEDULER_MAX_SLEEP", "3600"))
+
+# /mc コマンド群が共有する HTTP セッションの設定
+MC_HTTP_MAX_CONNECTIONS = int(os.getenv("MC_HTTP_MAX_CONNECTIONS", "20"))
+MC_HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("MC_HTTP_MAX_CONNECTIONS_PER_HOST", "5"))
+MC_HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("MC_HTTP_KEEPALIVE_TIMEOUT", "60"))
+MC_HTTP_DNS_CACHE_TTL = int(os.getenv("MC_HTTP_DNS_CACHE_TTL", "300"))
+MC_HTTP_CONNECT_TIMEOUT = float(os.getenv("MC_HTTP_CONNECT_TIMEOUT", "5"))
+MC_HTTP_TIMEOUT = float(os.getenv("MC_HTTP_TIMEOUT", "15"))
+MC_AVATAR_TIMEOUT = float(os.getenv("MC_AVATAR_TIMEOUT", "3"))
+MC_MCBANS_TIMEOUT = float(os.getenv("MC_MCBANS_TIMEOUT", "10"))
+
+# /mc コマンド群のキャッシュ設定 (TTL は秒、0 でキャッシュしない)
+MC_UUID_CACHE_TTL = float(os.getenv("MC_UUID_CACHE_TTL", "3600"))
+MC_UUID_NEGATIVE_CACHE_TTL = float(os.getenv("MC_UUID_NEGATIVE_CACHE_TTL", "300"))
+MC_UUID_CACHE_MAX_ENTRIES = int(os.getenv("MC_UUID_CACHE_MAX_ENTRIES", "5000"))
+MC_AVATAR_CACHE_TTL = float(os.getenv("MC_AVATAR_CACHE_TTL", "3600"))
+MC_AVATAR_CACHE_MAX_BYTES = int(os.getenv("MC_AVATAR_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+MC_MCBANS_CACHE_TTL = float(os.getenv("MC_MCBANS_CACHE_TTL", "600"))
+MC_MCBANS_CACHE_MAX_ENTRIES = int(os.getenv("MC_MCBANS_CACHE_MAX_ENTRIES", "1000"))
+
+# /mc bulk_lookup (一括検索) の設定
+MC_BULK_MAX_NAMES = int(os.getenv("MC_BULK_MAX_NAMES", "100"))
+MC_BULK_CONCURRENCY = int(os.getenv("MC_BULK_CONCURRENCY", "3"))
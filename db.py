@@ -0,0 +1,291 @@
+# db.py (Bot 全体で共有する MySQL 接続プール)
+
+import asyncio
+import functools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import mysql.connector
+from mysql.connector.errors import PoolError
+
+from config import (
+    DB_HOST, DB_USER, DB_PASSWORD, DB_NAME,
+    DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_MAX_LIFETIME, DB_POOL_PRE_PING, DB_MAX_CONCURRENCY
+)
+
+
+class _PoolEntry:
+    """プール内で管理する接続 1 本分の情報"""
+    __slots__ = ("cnx", "created_at")
+
+    def __init__(self, cnx):
+        self.cnx = cnx
+        self.created_at = time.monotonic()
+
+
+class PooledConnection:
+    """
+    プールから貸し出された接続のラッパー。
+    cursor() / commit() などは元の接続へ委譲し、close() で切断せずにプールへ返却する。
+    """
+
+    def __init__(self, pool: "ConnectionPool", entry: _PoolEntry):
+        self._pool = pool
+        self._entry = entry
+
+    def __getattr__(self, name):
+        if self._entry is None:
+            raise PoolError("返却済みの接続は使用できません。")
+        return getattr(self._entry.cnx, name)
+
+    def close(self):
+        if self._entry is not None:
+            entry, self._entry = self._entry, None
+            self._pool._release(entry)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    スレッドセーフな MySQL 接続プール。
+    - size: 同時に貸し出せる接続数の上限
+    - max_lifetime: 接続を作成してからこの秒数を過ぎたら破棄して作り直す
+    - pre_ping: 貸し出し前に ping して切断済みの接続を検出する
+    """
+
+    def __init__(self, size: int, timeout: float, max_lifetime: float, pre_ping: bool, **connect_args):
+        self.size = size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.pre_ping = pre_ping
+        self._connect_args = connect_args
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self) -> _PoolEntry:
+        return _PoolEntry(mysql.connector.connect(**self._connect_args))
+
+    def _is_expired(self, entry: _PoolEntry) -> bool:
+        return self.max_lifetime > 0 and time.monotonic() - entry.created_at >= self.max_lifetime
+
+    def _is_alive(self, entry: _PoolEntry) -> bool:
+        if not self.pre_ping:
+            return True
+        try:
+            entry.cnx.ping(reconnect=False)
+            return True
+        except mysql.connector.Error:
+            return False
+
+    @staticmethod
+    def _discard(entry: _PoolEntry):
+        try:
+            entry.cnx.close()
+        except Exception:
+            pass
+
+    def acquire(self) -> PooledConnection:
+        """プールから接続を 1 本取り出す。空きが無ければ timeout 秒まで待機する。"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolError(f"DB接続プールが枯渇しています (size={self.size})。")
+        try:
+            while True:
+                with self._lock:
+                    entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    entry = self._connect()
+                    break
+                if self._is_expired(entry) or not self._is_alive(entry):
+                    self._discard(entry)
+                    continue
+                break
+        except Exception:
+            self._slots.release()
+            raise
+        return PooledConnection(self, entry)
+
+    def _release(self, entry: _PoolEntry):
+        try:
+            # 未コミットのトランザクションが残っていれば破棄してから返却する
+            if entry.cnx.in_transaction:
+                entry.cnx.rollback()
+            if self._is_expired(entry) or not entry.cnx.is_connected():
+                self._discard(entry)
+            else:
+                with self._lock:
+                    self._idle.append(entry)
+        except mysql.connector.Error:
+            self._discard(entry)
+        finally:
+            self._slots.release()
+
+    def health_check(self) -> int:
+        """アイドル中の接続をすべて ping し、切断済み・寿命切れのものを破棄する。生存数を返す。"""
+        with self._lock:
+            entries = list(self._idle)
+            self._idle.clear()
+        alive = []
+        for entry in entries:
+            try:
+                if self._is_expired(entry):
+                    raise mysql.connector.Error("max lifetime exceeded")
+                entry.cnx.ping(reconnect=False)
+                alive.append(entry)
+            except mysql.connector.Error:
+                self._discard(entry)
+        with self._lock:
+            self._idle.extend(alive)
+        return len(alive)
+
+    def close_all(self):
+        """アイドル中の接続をすべて切断する (貸し出し中の接続は返却時に通常どおり処理される)。"""
+        with self._lock:
+            entries = list(self._idle)
+            self._idle.clear()
+        for entry in entries:
+            self._discard(entry)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    size=DB_POOL_SIZE,
+                    timeout=DB_POOL_TIMEOUT,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    pre_ping=DB_POOL_PRE_PING,
+                    host=DB_HOST,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                    database=DB_NAME,
+                )
+    return _pool
+
+
+def get_db_connection() -> PooledConnection:
+    """
+    共有プールから接続を取得する。
+    使い終わったら従来どおり close() を呼ぶと、切断されずにプールへ返却される。
+    """
+    return get_pool().acquire()
+
+
+# --------------------------------------------------------------------------------
+# 非同期アクセス層
+# mysql.connector は同期ドライバのため、クエリはすべて DB 専用のスレッドプールで実行する。
+# ワーカー数 (DB_MAX_CONCURRENCY) が同時実行数の上限となり、超えた分はキューで待機する。
+# 遅いクエリはそのインタラクションだけを待たせ、イベントループ (ハートビート等) は止めない。
+# --------------------------------------------------------------------------------
+_executor = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _pool_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=DB_MAX_CONCURRENCY, thread_name_prefix="db")
+    return _executor
+
+
+def _run_with_connection(func, *args, **kwargs):
+    conn = get_db_connection()
+    try:
+        return func(conn, *args, **kwargs)
+    finally:
+        conn.close()
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    func(conn, *args, **kwargs) を DB 専用スレッドで実行し、その戻り値を返す。
+    複数のクエリを 1 本の接続・トランザクションで実行したい場合に使う。
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_executor(), functools.partial(_run_with_connection, func, *args, **kwargs)
+    )
+
+
+async def run_in_db_thread(func, *args):
+    """接続を伴わない同期処理 (プールのヘルスチェック等) を DB 専用スレッドで実行する。"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(func, *args))
+
+
+def _fetch(conn, query, params, dictionary, many):
+    cursor = conn.cursor(dictionary=dictionary)
+    try:
+        cursor.execute(query, params)
+        return cursor.fetchall() if many else cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+def _execute(conn, query, params):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params)
+        conn.commit()
+        return cursor.rowcount, cursor.lastrowid
+    finally:
+        cursor.close()
+
+
+async def fetch_one(query: str, params=(), dictionary: bool = False):
+    """SELECT を実行して 1 行を返す (該当なしは None)。"""
+    return await run_db(_fetch, query, params, dictionary, False)
+
+
+async def fetch_all(query: str, params=(), dictionary: bool = False) -> list:
+    """SELECT を実行して全行を返す。"""
+    return await run_db(_fetch, query, params, dictionary, True)
+
+
+async def execute(query: str, params=()) -> int:
+    """INSERT / UPDATE / DELETE を実行してコミットし、影響を受けた行数を返す。"""
+    rowcount, _ = await run_db(_execute, query, params)
+    return rowcount
+
+
+async def insert(query: str, params=()) -> int:
+    """INSERT を実行してコミットし、lastrowid を返す。"""
+    _, lastrowid = await run_db(_execute, query, params)
+    return lastrowid
+
+
+# --------------------------------------------------------------------------------
+# Bot の永続状態 (同期ウォーターマーク等) を保存するキーバリューテーブル
+#   CREATE TABLE bot_state (
+#       state_key   VARCHAR(64)  NOT NULL PRIMARY KEY,
+#       state_value TEXT         NOT NULL,
+#       updated_at  DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+#   );
+# --------------------------------------------------------------------------------
+async def get_state(key: str):
+    """bot_state から値を取得する。未保存なら None。"""
+    row = await fetch_one("SELECT state_value FROM bot_state WHERE state_key = %s", (key,))
+    return row[0] if row else None
+
+
+async def set_state(key: str, value: str):
+    """bot_state に値を保存する (既存キーは上書き)。"""
+    await execute(
+        "INSERT INTO bot_state (state_key, state_value) VALUES (%s, %s) "
+        "ON DUPLICATE KEY UPDATE state_value = VALUES(state_value)",
+        (key, str(value))
+    )
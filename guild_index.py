@@ -0,0 +1,114 @@
+# guild_index.py (ギルドのチャンネル・カテゴリを名前で引くための索引)
+#
+# discord.utils.get(guild.text_channels, name=...) はチャンネル一覧の並べ替えと線形探索を毎回行うため、
+# チャンネル数の多いギルドではイベントごと・ループの各行ごとに O(n) のコストがかかる。
+# ここではギルドごとに (種類, 名前) -> チャンネルID の索引を持ち、Gateway の
+# チャンネル作成・更新・削除イベントで差分更新する。実体は guild.get_channel() (ID での O(1) 参照) で取得する。
+# ロールは guild.get_role() が既に ID の辞書引きのため索引は持たない。
+
+import discord
+
+_TEXT = "text"
+_CATEGORY = "category"
+
+
+def _kind(channel) -> str:
+    if isinstance(channel, discord.TextChannel):
+        return _TEXT
+    if isinstance(channel, discord.CategoryChannel):
+        return _CATEGORY
+    return None
+
+
+class GuildIndex:
+    def __init__(self):
+        self._guilds = {}  # guild_id -> {(種類, 名前): {channel_id: None}}
+
+    def rebuild(self, guild: discord.Guild):
+        index = {}
+        for channel in guild.channels:
+            kind = _kind(channel)
+            if kind:
+                index.setdefault((kind, channel.name), {})[channel.id] = None
+        self._guilds[guild.id] = index
+
+    def forget(self, guild: discord.Guild):
+        self._guilds.pop(guild.id, None)
+
+    def _index(self, guild: discord.Guild) -> dict:
+        index = self._guilds.get(guild.id)
+        if index is None:
+            self.rebuild(guild)
+            index = self._guilds[guild.id]
+        return index
+
+    def add(self, channel):
+        kind = _kind(channel)
+        if kind and channel.guild.id in self._guilds:
+            self._guilds[channel.guild.id].setdefault((kind, channel.name), {})[channel.id] = None
+
+    def remove(self, channel, name: str = None):
+        kind = _kind(channel)
+        index = self._guilds.get(channel.guild.id)
+        if not kind or index is None:
+            return
+        key = (kind, name if name is not None else channel.name)
+        ids = index.get(key)
+        if ids is not None:
+            ids.pop(channel.id, None)
+            if not ids:
+                del index[key]
+
+    def _lookup(self, guild: discord.Guild, kind: str, name: str, retry: bool = True):
+        for channel_id in self._index(guild).get((kind, name), ()):
+            channel = guild.get_channel(channel_id)
+            if channel is not None and channel.name == name:
+                return channel
+            if retry:
+                # イベントを取りこぼして実体と食い違っている場合は索引を作り直す
+                self.rebuild(guild)
+                return self._lookup(guild, kind, name, retry=False)
+        return None
+
+    def text_channel(self, guild: discord.Guild, name: str) -> discord.TextChannel:
+        """名前が一致するテキストチャンネルを返す (無ければ None)"""
+        return self._lookup(guild, _TEXT, name)
+
+    def category(self, guild: discord.Guild, name: str) -> discord.CategoryChannel:
+        """名前が一致するカテゴリを返す (無ければ None)"""
+        return self._lookup(guild, _CATEGORY, name)
+
+    def attach(self, bot):
+        """Gateway イベントで索引を更新するリスナーを登録する"""
+        async def on_guild_channel_create(channel):
+            self.add(channel)
+
+        async def on_guild_channel_delete(channel):
+            self.remove(channel)
+
+        async def on_guild_channel_update(before, after):
+            if before.name != after.name:
+                self.remove(before)
+                self.add(after)
+
+        async def on_guild_available(guild):
+            self.rebuild(guild)
+
+        async def on_guild_remove(guild):
+            self.forget(guild)
+
+        for listener in (on_guild_channel_create, on_guild_channel_delete, on_guild_channel_update,
+                         on_guild_available, on_guild_remove):
+            bot.add_listener(listener, listener.__name__)
+        bot.add_listener(on_guild_available, "on_guild_join")
+
+
+_index = None
+
+
+def get_guild_index() -> GuildIndex:
+    """Bot 全体で共有するギルド索引を返す。"""
+    global _index
+    if _index is None:
+        _index = GuildIndex()
+    return _index
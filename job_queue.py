@@ -0,0 +1,235 @@
+# job_queue.py (MySQL に永続化するバックグラウンドジョブキュー)
+#
+#   CREATE TABLE bot_jobs (
+#       id         BIGINT      NOT NULL AUTO_INCREMENT PRIMARY KEY,
+#       kind       VARCHAR(64) NOT NULL,
+#       payload    TEXT        NOT NULL,
+#       status     VARCHAR(16) NOT NULL DEFAULT 'pending',  -- pending / running / done / failed
+#       attempts   INT         NOT NULL DEFAULT 0,
+#       run_after  DATETIME    NOT NULL DEFAULT CURRENT_TIMESTAMP,
+#       last_error TEXT        NULL,
+#       created_at DATETIME    NOT NULL DEFAULT CURRENT_TIMESTAMP,
+#       updated_at DATETIME    NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+#       INDEX idx_bot_jobs_status_run_after (status, run_after)
+#   );
+
+import asyncio
+import contextvars
+import json
+import traceback
+
+from config import JOB_WORKERS, JOB_MAX_ATTEMPTS, JOB_RETRY_BASE_DELAY, JOB_RETRY_MAX_DELAY, JOB_POLL_INTERVAL
+from db import execute, insert, run_db
+
+# 実行中のジョブ ID (ハンドラ内から checkpoint() するため)
+_current_job_id = contextvars.ContextVar("current_job_id", default=None)
+
+
+class JobQueue:
+    """
+    種類 (kind) ごとにハンドラを登録し、bot_jobs テーブルに積まれたジョブをワーカーで処理する。
+    - 失敗したジョブは指数バックオフで再試行し、max_attempts 回失敗したら failed にする
+    - Bot 起動時に running のまま残っているジョブ (処理中に停止したもの) を pending に戻して再開する
+    - ハンドラが payload に書き込んだ内容 (完了した手順など) は再試行時に引き継がれる
+    - 種類ごとに同時実行数の上限を設定でき、長時間かかるジョブがすべてのワーカーを占有しないようにする
+    """
+
+    def __init__(self, workers: int, max_attempts: int, retry_base_delay: float, retry_max_delay: float, poll_interval: float):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.poll_interval = poll_interval
+        self._handlers = {}
+        self._limits = {}
+        self._running = {}
+        self._wakeup = asyncio.Event()
+        self._enqueue_lock = asyncio.Lock()
+        self._tasks = []
+
+    def register(self, kind: str, handler, on_failure=None, max_concurrency: int = None):
+        """
+        handler(payload: dict) を kind のジョブに登録する。
+        on_failure(payload: dict, error: str) は再試行を使い切って failed になった時に呼ばれる。
+        max_concurrency を指定すると、この kind のジョブを同時に実行するワーカー数をその数までに制限する。
+        """
+        self._handlers[kind] = (handler, on_failure)
+        if max_concurrency:
+            self._limits[kind] = max_concurrency
+            self._running.setdefault(kind, 0)
+
+    async def enqueue(self, kind: str, payload: dict, unique_key: str = None) -> int:
+        """
+        ジョブを追加して ID を返す。待機中のワーカーはすぐに起こされる。
+        unique_key (payload のキー名) を指定すると、その値が同じ同種のジョブが pending / running で
+        既にある場合は追加せず None を返す (二重クリックなどで同じ処理を 2 回積まないため)。
+        """
+        if unique_key is None:
+            job_id = await insert(
+                "INSERT INTO bot_jobs (kind, payload) VALUES (%s, %s)",
+                (kind, json.dumps(payload, ensure_ascii=False))
+            )
+        else:
+            # 同じプロセス内の同時呼び出しは確認から追加までを直列化する
+            async with self._enqueue_lock:
+                job_id = await run_db(self._insert_unique, kind, payload, unique_key)
+            if job_id is None:
+                return None
+        self._wakeup.set()
+        return job_id
+
+    @staticmethod
+    def _insert_unique(conn, kind, payload, unique_key):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT id FROM bot_jobs WHERE kind = %s AND status IN ('pending', 'running') "
+                "AND JSON_UNQUOTE(JSON_EXTRACT(payload, %s)) = %s LIMIT 1 FOR UPDATE",
+                (kind, f"$.{unique_key}", str(payload[unique_key]))
+            )
+            if cursor.fetchone():
+                conn.commit()
+                return None
+            cursor.execute(
+                "INSERT INTO bot_jobs (kind, payload) VALUES (%s, %s)",
+                (kind, json.dumps(payload, ensure_ascii=False))
+            )
+            conn.commit()
+            return cursor.lastrowid
+        finally:
+            cursor.close()
+
+    async def checkpoint(self, payload: dict):
+        """
+        ハンドラ内から呼び、実行中のジョブの payload を保存する。
+        再試行時だけでなく、処理中に Bot が停止した場合にも進捗が引き継がれる。
+        """
+        job_id = _current_job_id.get()
+        if job_id is not None:
+            await execute(
+                "UPDATE bot_jobs SET payload = %s WHERE id = %s", (json.dumps(payload, ensure_ascii=False), job_id)
+            )
+
+    async def start(self):
+        """中断されたジョブを再開可能な状態に戻し、ワーカーを起動する (2 回目以降の呼び出しは無視)。"""
+        if self._tasks:
+            return
+        resumed = await execute("UPDATE bot_jobs SET status = 'pending', run_after = NOW() WHERE status = 'running'")
+        if resumed:
+            print(f"🔁 中断されていたジョブ {resumed} 件を再開します。")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    @staticmethod
+    def _claim(conn, kinds):
+        placeholders = ", ".join(["%s"] * len(kinds))
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                f"SELECT id, kind, payload, attempts FROM bot_jobs "
+                f"WHERE status = 'pending' AND run_after <= NOW() AND kind IN ({placeholders}) "
+                f"ORDER BY run_after, id LIMIT 1 FOR UPDATE SKIP LOCKED",
+                tuple(kinds)
+            )
+            row = cursor.fetchone()
+            if row:
+                cursor.execute(
+                    "UPDATE bot_jobs SET status = 'running', attempts = attempts + 1 WHERE id = %s", (row[0],)
+                )
+            conn.commit()
+            return row
+        finally:
+            cursor.close()
+
+    def _reserve_kinds(self) -> list:
+        """取得対象の kind を返す。上限のある kind は取得前に枠を確保しておく (他のワーカーと同時に取得しないため)。"""
+        kinds = []
+        for kind in self._handlers:
+            limit = self._limits.get(kind)
+            if limit is None:
+                kinds.append(kind)
+            elif self._running[kind] < limit:
+                self._running[kind] += 1
+                kinds.append(kind)
+        return kinds
+
+    def _release(self, kind: str):
+        if kind in self._limits:
+            self._running[kind] -= 1
+
+    async def _worker(self):
+        while True:
+            # 取得前にクリアしておき、取得中に追加されたジョブの通知を取りこぼさないようにする
+            self._wakeup.clear()
+            kinds = self._reserve_kinds()
+            try:
+                row = await run_db(self._claim, kinds) if kinds else None
+            except Exception as e:
+                print(f"❌ ジョブの取得中にエラーが発生しました: {e}")
+                row = None
+            claimed_kind = row[1] if row else None
+            # 取得しなかった kind の枠は返す
+            for kind in kinds:
+                if kind != claimed_kind:
+                    self._release(kind)
+
+            if not row:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._process(*row)
+            except Exception as e:
+                print(f"❌ ジョブ {row[0]} の状態更新中にエラーが発生しました: {e}")
+            finally:
+                if claimed_kind in self._limits:
+                    self._release(claimed_kind)
+                    # 上限で取得を見送っていたジョブを、待機中のワーカーがすぐに取得できるようにする
+                    self._wakeup.set()
+
+    async def _process(self, job_id, kind, payload, attempts):
+        attempts += 1
+        handler, on_failure = self._handlers[kind]
+        payload = json.loads(payload)
+        _current_job_id.set(job_id)
+        try:
+            await handler(payload)
+            await execute("UPDATE bot_jobs SET status = 'done', last_error = NULL WHERE id = %s", (job_id,))
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+            if attempts >= self.max_attempts:
+                print(f"❌ ジョブ {job_id} ({kind}) は {attempts} 回失敗したため中止しました: {error}")
+                await execute("UPDATE bot_jobs SET status = 'failed', last_error = %s WHERE id = %s", (error, job_id))
+                if on_failure:
+                    try:
+                        await on_failure(payload, error)
+                    except Exception as notify_error:
+                        print(f"❌ ジョブ {job_id} の失敗通知でエラーが発生しました: {notify_error}")
+            else:
+                delay = min(self.retry_base_delay * 2 ** (attempts - 1), self.retry_max_delay)
+                print(f"⚠️ ジョブ {job_id} ({kind}) が失敗しました。{delay:.0f} 秒後に再試行します: {error}")
+                await execute(
+                    "UPDATE bot_jobs SET status = 'pending', payload = %s, last_error = %s, "
+                    "run_after = NOW() + INTERVAL %s SECOND WHERE id = %s",
+                    (json.dumps(payload, ensure_ascii=False), error, int(delay), job_id)
+                )
+
+
+_queue = None
+
+
+def get_job_queue() -> JobQueue:
+    """Bot 全体で共有するジョブキューを返す。"""
+    global _queue
+    if _queue is None:
+        _queue = JobQueue(
+            workers=JOB_WORKERS,
+            max_attempts=JOB_MAX_ATTEMPTS,
+            retry_base_delay=JOB_RETRY_BASE_DELAY,
+            retry_max_delay=JOB_RETRY_MAX_DELAY,
+            poll_interval=JOB_POLL_INTERVAL,
+        )
+    return _queue
@@ -1,8 +1,12 @@
 # main.py (起動ファイル) の修正案
 
-from config import ADMIN_GUILD_ID, USER_GUILD_ID
+from config import ADMIN_GUILD_ID, USER_GUILD_ID, DB_POOL_HEALTH_CHECK_INTERVAL
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
+from db import get_pool, run_in_db_thread
+from job_queue import get_job_queue
+from scheduler import get_scheduler
+from guild_index import get_guild_index
 import importlib
 import pathlib
 
@@ -10,6 +14,8 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 bot = commands.Bot(command_prefix="!", intents=intents)
+# チャンネル・カテゴリを名前で引く索引 (各コマンドモジュールから使用する)
+get_guild_index().attach(bot)
 
 # トークン読み込み
 with open('.discord_token') as f:
@@ -54,10 +60,28 @@ async def setup_hook():
     # print(f"🌐 グローバルに {len(synced_global)} 件のコマンドを同期しました。")
 
 
+# 🔹 DB 接続プールのヘルスチェック (アイドル接続の切断・寿命切れを検出して破棄)
+@tasks.loop(seconds=DB_POOL_HEALTH_CHECK_INTERVAL or 300)
+async def db_pool_health_check():
+    try:
+        await run_in_db_thread(get_pool().health_check)
+    except Exception as e:
+        print(f"❌ DB接続プールのヘルスチェックでエラーが発生しました: {e}")
+
+
 # 🔹 Bot 起動ログ
 @bot.event
 async def on_ready():
     print(f"🤖 ログインしました: {bot.user}（ID: {bot.user.id}）")
+    if DB_POOL_HEALTH_CHECK_INTERVAL > 0 and not db_pool_health_check.is_running():
+        db_pool_health_check.start()
+    # 各モジュールが登録したジョブの処理を開始 (前回停止時に中断されたジョブも再開される)
+    try:
+        await get_job_queue().start()
+    except Exception as e:
+        print(f"❌ ジョブキューの起動に失敗しました: {e}")
+    # チャンネルの自動削除などの期限を DB から読み込み、期限ちょうどに実行する
+    await get_scheduler().start()
 
 # 🔹 Bot 起動
 bot.run(DISCORD_TOKEN)
\ No newline at end of file
@@ -0,0 +1,130 @@
+# scheduler.py (期限付きの処理を期限ちょうどに実行するスケジューラ)
+#
+# チャンネルの自動削除など「ある日時を過ぎたら実行する」処理を、優先度付きキュー (heapq) で管理する。
+# 起動時に各モジュールの loader で DB から期限を読み込み、以降はクローズ・承認・延長のたびに
+# schedule() で追加・更新する。次の期限まで眠るため、期限が来ていない間は DB を読まない。
+# 期限を迎えたものは種類 (kind) ごとにまとめて handler(keys) に渡し、種類ごとの handler は並行して実行する。
+# handler が失敗した keys を返した場合 (または例外を送出した場合) は、retry_delay 秒後に再実行する。
+
+import asyncio
+import datetime
+import heapq
+import itertools
+
+from config import SCHEDULER_RETRY_DELAY, SCHEDULER_MAX_SLEEP
+
+# 種類 (kind) の名前 (予約する側と処理する側のモジュールで共有する)
+TICKET_CHANNEL_EXPIRY = "ticket_channel"
+ESCALATION_CHANNEL_EXPIRY = "escalation_channel"
+PRIVATE_CHANNEL_EXPIRY = "private_channel"
+
+
+class DeadlineScheduler:
+    """
+    (kind, key) ごとに期限を 1 つ持つスケジューラ。同じ (kind, key) を schedule() し直すと期限が置き換わる。
+    期限は DB の DATETIME と同じくローカル時刻の naive な datetime で扱う。
+    """
+
+    def __init__(self, retry_delay: float, max_sleep: float):
+        self.retry_delay = retry_delay
+        self.max_sleep = max_sleep
+        self._handlers = {}
+        self._heap = []
+        self._deadlines = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._started = False
+        self._task = None
+
+    def register(self, kind: str, handler, loader=None):
+        """
+        handler(keys: list) を kind に登録する。
+        handler は処理できなかった keys を返す (すべて処理できた場合は None / 空)。返された keys は
+        retry_delay 秒後に再実行し、例外を送出した場合は同じ keys をすべて再実行する。
+        loader() は起動時に呼ばれ、[(key, 期限)] を返す。
+        """
+        self._handlers[kind] = (handler, loader)
+
+    def schedule(self, kind: str, key, due_at: datetime.datetime):
+        """(kind, key) の期限を due_at に設定する (既存の期限は置き換える)。"""
+        self._deadlines[(kind, key)] = due_at
+        heapq.heappush(self._heap, (due_at, next(self._counter), kind, key))
+        self._wakeup.set()
+
+    def cancel(self, kind: str, key):
+        # ヒープからは取り除かず、取り出した時に無視する
+        self._deadlines.pop((kind, key), None)
+
+    async def start(self):
+        """各 loader で期限を読み込み、スケジューラを起動する (2 回目以降の呼び出しは無視)。"""
+        if self._started:
+            return
+        self._started = True
+        for kind, (_, loader) in self._handlers.items():
+            if loader is None:
+                continue
+            try:
+                entries = await loader()
+            except Exception as e:
+                print(f"❌ スケジュール ({kind}) の読み込みに失敗しました: {e}")
+                continue
+            for key, due_at in entries:
+                self.schedule(kind, key, due_at)
+            print(f"🗓️ スケジュール ({kind}) を {len(entries)} 件読み込みました。")
+        self._task = asyncio.create_task(self._run())
+
+    def _pop_due(self, now: datetime.datetime) -> dict:
+        due = {}
+        while self._heap and self._heap[0][0] <= now:
+            due_at, _, kind, key = heapq.heappop(self._heap)
+            if self._deadlines.get((kind, key)) != due_at:
+                continue  # キャンセル済み、または期限が変更された古いエントリ
+            del self._deadlines[(kind, key)]
+            due.setdefault(kind, []).append(key)
+        return due
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = datetime.datetime.now()
+            due = self._pop_due(now)
+            if due:
+                # 種類ごとに並行して実行し、遅い handler (レート制限中の削除等) が他の種類の期限を遅らせないようにする
+                await asyncio.gather(
+                    *(self._dispatch(kind, keys) for kind, keys in due.items()), return_exceptions=True
+                )
+
+            if self._heap:
+                timeout = min(max((self._heap[0][0] - datetime.datetime.now()).total_seconds(), 0), self.max_sleep)
+            else:
+                timeout = self.max_sleep
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _dispatch(self, kind: str, keys: list):
+        handler, _ = self._handlers[kind]
+        try:
+            failed = await handler(keys)
+        except Exception as e:
+            print(f"⚠️ スケジュール ({kind}) の実行に失敗しました。{self.retry_delay:.0f} 秒後に再試行します: {e}")
+            failed = keys
+        else:
+            if failed:
+                print(f"⚠️ スケジュール ({kind}) の {len(failed)} 件を処理できませんでした。{self.retry_delay:.0f} 秒後に再試行します。")
+        retry_at = datetime.datetime.now() + datetime.timedelta(seconds=self.retry_delay)
+        for key in failed or ():
+            if (kind, key) not in self._deadlines:
+                self.schedule(kind, key, retry_at)
+
+
+_scheduler = None
+
+
+def get_scheduler() -> DeadlineScheduler:
+    """Bot 全体で共有するスケジューラを返す。"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = DeadlineScheduler(retry_delay=SCHEDULER_RETRY_DELAY, max_sleep=SCHEDULER_MAX_SLEEP)
+    return _scheduler
@@ -0,0 +1,268 @@
+# storage.py (Bot 全体で共有する MinIO オブジェクトストレージの非同期ラッパー)
+
+import asyncio
+import datetime
+import functools
+import io
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import certifi
+import urllib3
+from minio import Minio
+from minio.error import S3Error
+
+from config import (
+    MINIO_ENDPOINT, MINIO_ACCESS_KEY, MINIO_SECRET_KEY, MINIO_BUCKET_NAME, MINIO_USE_SSL,
+    MINIO_PART_SIZE, STORAGE_MAX_WORKERS, STORAGE_MAX_UPLOADS, STORAGE_MAX_CONNECTIONS
+)
+
+# MinIO (S3) のマルチパートアップロードで許容される最小パートサイズ
+MIN_PART_SIZE = 5 * 1024 * 1024
+# ダウンロード時にストリームから読み込む単位
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class StreamingUpload:
+    """
+    イベントループ側から write() したバイト列を、別スレッドで実行中の put_object へ
+    パイプで流し込むマルチパートアップロード。
+    全体の長さが分からなくてもよく、メモリ上に保持するのは未送信のチャンク (max_pending 個) と
+    MinIO クライアントが組み立て中の 1 パート分だけになる。
+    put_object は書き込みが終わるまでスレッドを占有するため、ストレージ共通のスレッドプールではなく
+    アップロード専用のスレッドプールで実行する (書き込み側が共通のプールで download_to 等を待っても詰まらない)。
+    同時に実行するアップロードは STORAGE_MAX_UPLOADS 個までで、それを超えた分は空きが出るまで待つ。
+
+        upload = get_storage().open_upload("path/to/object.txt", "text/plain")
+        try:
+            async for chunk in ...:
+                await upload.write(chunk)
+            await upload.finish()
+        except Exception as e:
+            await upload.abort(e)
+            raise
+    """
+
+    _EOF = object()
+
+    def __init__(self, client, bucket: str, object_name: str, content_type: str = "application/octet-stream",
+                 length: int = -1, part_size: int = MIN_PART_SIZE, max_pending: int = 8):
+        self.client = client
+        self.bucket = bucket
+        self.object_name = object_name
+        self.content_type = content_type
+        self.length = length
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.max_pending = max_pending
+        self.bytes_written = 0
+        self._queue = queue.Queue()
+        self._pending = b""
+        self._eof = False
+        self._finished = threading.Event()
+        self._loop = None
+        self._slots = None
+        self._future = None
+
+    # --- アップロードスレッド側 ---------------------------------------------------
+    def read(self, size: int = -1) -> bytes:
+        """put_object から呼ばれる file-like な read。書き込み側が閉じるまでブロックする。"""
+        while not self._pending and not self._eof:
+            item = self._queue.get()
+            if item is self._EOF:
+                self._eof = True
+            elif isinstance(item, BaseException):
+                self._eof = True
+                raise item
+            else:
+                self._pending = item
+                # 受け取った分だけ書き込み側の枠を空ける
+                self._loop.call_soon_threadsafe(self._slots.release)
+        if size is None or size < 0 or size >= len(self._pending):
+            data, self._pending = self._pending, b""
+        else:
+            data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def _upload(self):
+        try:
+            return self.client.put_object(
+                self.bucket,
+                self.object_name,
+                data=self,
+                length=self.length,
+                part_size=self.part_size,
+                content_type=self.content_type,
+            )
+        finally:
+            self._finished.set()
+            # アップロードスレッドが先に終了 (失敗) した場合に、書き込み側が永久に待たないようにする
+            self._loop.call_soon_threadsafe(self._release_all)
+
+    def _release_all(self):
+        for _ in range(self.max_pending):
+            self._slots.release()
+
+    # --- イベントループ側 ---------------------------------------------------------
+    def start(self, executor):
+        self._loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._future = self._loop.run_in_executor(executor, self._upload)
+        return self
+
+    async def _send(self, item, wait_for_slot: bool = True):
+        if wait_for_slot:
+            await self._slots.acquire()
+        if self._finished.is_set():
+            # アップロードが既に終了 (失敗) している場合は、その例外を送出する
+            await self._future
+            raise RuntimeError(f"{self.object_name} のアップロードは既に終了しています。")
+        self._queue.put_nowait(item)
+
+    async def write(self, data: bytes):
+        if data:
+            self.bytes_written += len(data)
+            await self._send(bytes(data))
+
+    async def finish(self):
+        """書き込みを終了し、アップロードの完了を待つ。"""
+        await self._send(self._EOF, wait_for_slot=False)
+        return await self._future
+
+    async def abort(self, exc: BaseException = None):
+        """アップロードを中断する (マルチパートアップロードは MinIO クライアント側で破棄される)。"""
+        if self._future is None:
+            return
+        try:
+            if not self._finished.is_set():
+                await self._send(exc or RuntimeError("upload aborted"), wait_for_slot=False)
+            await self._future
+        except Exception:
+            pass
+
+
+class AsyncStorage:
+    """
+    同期クライアントである minio.Minio を、ストレージ専用のスレッドプール上で実行する非同期ラッパー。
+    HTTP 接続は urllib3 の PoolManager で再利用し、転送中もイベントループを止めない。
+    """
+
+    def __init__(self, client: Minio, bucket: str, part_size: int, max_workers: int, max_uploads: int):
+        self.client = client
+        self.bucket = bucket
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="storage")
+        # ストリーミングアップロード専用 (書き込みが終わるまでスレッドを占有するため、共通のプールとは分ける)
+        self._upload_executor = ThreadPoolExecutor(max_workers=max_uploads, thread_name_prefix="storage-upload")
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def open_upload(self, object_name: str, content_type: str = "application/octet-stream", length: int = -1) -> StreamingUpload:
+        """ストリーミングアップロードを開始して返す。"""
+        return StreamingUpload(
+            self.client, self.bucket, object_name, content_type=content_type, length=length, part_size=self.part_size
+        ).start(self._upload_executor)
+
+    def _put_bytes(self, object_name, data, content_type):
+        return self.client.put_object(
+            self.bucket, object_name, data=io.BytesIO(data), length=len(data), content_type=content_type
+        )
+
+    async def put_bytes(self, object_name: str, data: bytes, content_type: str = "application/octet-stream"):
+        """小さなオブジェクト (マニフェスト等) を一括でアップロードする。"""
+        return await self._run(self._put_bytes, object_name, data, content_type)
+
+    def _put_file(self, object_name, fileobj, length, content_type):
+        return self.client.put_object(
+            self.bucket, object_name, data=fileobj, length=length, part_size=self.part_size, content_type=content_type
+        )
+
+    async def put_file(self, object_name: str, fileobj, length: int, content_type: str = "application/octet-stream"):
+        """ファイル (一時ファイル等) の内容をアップロードする。大きなファイルはマルチパートで送信される。"""
+        return await self._run(self._put_file, object_name, fileobj, length, content_type)
+
+    def _get_bytes(self, object_name):
+        response = self.client.get_object(self.bucket, object_name)
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+    async def get_bytes(self, object_name: str) -> bytes:
+        """オブジェクト全体をメモリに読み込んで返す。"""
+        return await self._run(self._get_bytes, object_name)
+
+    def _download_to(self, object_name, fileobj):
+        response = self.client.get_object(self.bucket, object_name)
+        try:
+            size = 0
+            for chunk in response.stream(DOWNLOAD_CHUNK_SIZE):
+                fileobj.write(chunk)
+                size += len(chunk)
+            return size
+        finally:
+            response.close()
+            response.release_conn()
+
+    async def download_to(self, object_name: str, fileobj) -> int:
+        """オブジェクトをチャンク単位で fileobj に書き出し、書き込んだバイト数を返す。"""
+        return await self._run(self._download_to, object_name, fileobj)
+
+    def _list_objects(self, prefix, recursive):
+        return list(self.client.list_objects(self.bucket, prefix=prefix, recursive=recursive))
+
+    async def list_objects(self, prefix: str, recursive: bool = True) -> list:
+        return await self._run(self._list_objects, prefix, recursive)
+
+    async def presigned_get_url(self, object_name: str, expires: datetime.timedelta) -> str:
+        """期限付きのダウンロード URL を発行する (Bot を経由せずに直接ダウンロードさせる)。"""
+        return await self._run(self.client.presigned_get_object, self.bucket, object_name, expires=expires)
+
+    def _stat_if_exists(self, object_name):
+        try:
+            return self.client.stat_object(self.bucket, object_name)
+        except S3Error as e:
+            if e.code in ("NoSuchKey", "NoSuchObject"):
+                return None
+            raise
+
+    async def stat_if_exists(self, object_name: str):
+        """オブジェクトの情報を返す。存在しなければ None。"""
+        return await self._run(self._stat_if_exists, object_name)
+
+    async def object_exists(self, object_name: str) -> bool:
+        return await self.stat_if_exists(object_name) is not None
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> AsyncStorage:
+    """Bot 全体で共有するストレージクライアントを返す。"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                http_client = urllib3.PoolManager(
+                    maxsize=STORAGE_MAX_CONNECTIONS,
+                    timeout=urllib3.Timeout(connect=10, read=300),
+                    cert_reqs="CERT_REQUIRED",
+                    ca_certs=certifi.where(),
+                    retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+                )
+                client = Minio(
+                    MINIO_ENDPOINT,
+                    access_key=MINIO_ACCESS_KEY,
+                    secret_key=MINIO_SECRET_KEY,
+                    secure=MINIO_USE_SSL == "true",
+                    http_client=http_client,
+                )
+                _storage = AsyncStorage(
+                    client, MINIO_BUCKET_NAME, part_size=MINIO_PART_SIZE,
+                    max_workers=STORAGE_MAX_WORKERS, max_uploads=STORAGE_MAX_UPLOADS
+                )
+    return _storage
@@ -0,0 +1,510 @@
+# transcript.py (チケットチャンネルのログをリアルタイムに記録するキャプチャ)
+#
+# チケットカテゴリ内のメッセージ (投稿・編集・削除) をケースごとにバッファし、
+# 一定間隔でセグメントとしてオブジェクトストレージへ書き出す。
+# セグメントは 1 行 1 エントリの JSON Lines を gzip 圧縮したもので、
+#   {"type": "message" | "edit" | "delete", "id": メッセージID, "at": ISO 8601 (UTC),
+#    "author_id": ..., "author": 表示名, "content": 本文, "attachments": [attachment_info(), ...]}
+# 従来のテキストログ (.txt) は render_transcript() で必要な時に生成する。
+# 添付ファイルも投稿された時点で保存する (CDN の URL には有効期限があるため)。
+# 添付ファイルの実体は内容のハッシュをキーにしたブロブ (blobs/sha256/..) として重複なく保存し、
+# ケースからはセグメントとマニフェストの attachments (ファイル名・サイズ・ブロブのキー) で参照する。
+# 添付ファイルの参照はメッセージと同じセグメントに記録し、保存結果 (ブロブのキー) は保存が終わった時点の
+# セグメントに記録する。クローズ時にブロブのキーが無いもの (保存中に Bot が停止した等) は保存し直す。
+# クローズ時は最後のセグメントを書き出してマニフェストを作るだけで済むため、
+# チケットの長さに関わらずクローズ処理の時間が一定になる。
+#
+#   CREATE TABLE transcript_segments (
+#       id              BIGINT       NOT NULL AUTO_INCREMENT PRIMARY KEY,
+#       CaseId          VARCHAR(12)  NOT NULL,
+#       object_key      VARCHAR(255) NOT NULL,
+#       first_at        DATETIME     NOT NULL,
+#       last_at         DATETIME     NOT NULL,
+#       entry_count     INT          NOT NULL,
+#       size_bytes      INT          NOT NULL,
+#       sha256          CHAR(64)     NULL,
+#       last_message_id BIGINT       NULL,
+#       attachments     TEXT         NULL,  -- このセグメントに含まれる添付ファイルの JSON 配列
+#       created_at      DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+#       INDEX idx_transcript_segments_case (CaseId, id)
+#   );
+#
+# ケースのマニフェスト (ログ・添付ファイルのキー、サイズ、Content-Type、チェックサム) のキーは
+# tickets に保存し、取得時はバケットを一覧せずにマニフェストから直接参照する。
+#
+#   ALTER TABLE tickets ADD COLUMN manifest_key VARCHAR(255) NULL;
+
+import aiohttp
+import asyncio
+import datetime
+import gzip
+import hashlib
+import json
+import mimetypes
+import tempfile
+
+import discord
+
+from config import TICKET_CATEGORY_ID, TRANSCRIPT_SEGMENT_MAX_BYTES, ATTACHMENT_ARCHIVE_CONCURRENCY
+from db import fetch_all, insert, execute
+from storage import get_storage
+
+
+def parse_case_id(channel) -> str:
+    """チケットチャンネルなら CaseId を、そうでなければ None を返す。"""
+    if getattr(channel, "category_id", None) != TICKET_CATEGORY_ID or not getattr(channel, "name", None):
+        return None
+    case_id = channel.name.split("-")[0]
+    if len(case_id) == 12 and case_id.isdigit():
+        return case_id
+    return None
+
+
+def _utc(dt: datetime.datetime) -> datetime.datetime:
+    """aware な datetime を naive な UTC に揃える (DB とマニフェストは naive UTC で扱う)"""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def message_entry(message: discord.Message) -> dict:
+    """メッセージ1件をログの1エントリにする"""
+    return {
+        "type": "message",
+        "id": message.id,
+        "at": _utc(message.created_at).isoformat(),
+        "author_id": message.author.id,
+        "author": message.author.display_name,
+        "content": message.content,
+        "attachments": [attachment_info(att) for att in message.attachments],
+    }
+
+
+def edit_entry(channel, data: dict) -> dict:
+    """on_raw_message_edit の生データから編集エントリを作る (本文の編集でなければ None)"""
+    if "content" not in data or not data.get("edited_timestamp"):
+        return None  # 埋め込みの展開など、本文の編集ではない更新
+    author = data.get("author") or {}
+    member = channel.guild.get_member(int(author["id"])) if "id" in author else None
+    return {
+        "type": "edit",
+        "id": int(data["id"]),
+        "at": _utc(discord.utils.parse_time(data["edited_timestamp"])).isoformat(),
+        "author_id": int(author["id"]) if "id" in author else None,
+        "author": member.display_name if member else (author.get("global_name") or author.get("username")),
+        "content": data["content"],
+        "attachments": [],
+    }
+
+
+def delete_entry(message_id: int, cached_message: discord.Message = None) -> dict:
+    """削除エントリを作る (キャッシュに残っていれば削除前の内容も残す)"""
+    return {
+        "type": "delete",
+        "id": message_id,
+        "at": _utc(discord.utils.utcnow()).isoformat(),
+        "author_id": cached_message.author.id if cached_message else None,
+        "author": cached_message.author.display_name if cached_message else None,
+        "content": cached_message.content if cached_message else None,
+        "attachments": [],
+    }
+
+
+_EVENT_LABELS = {"edit": "編集", "delete": "削除"}
+
+
+def render_entry(entry: dict) -> str:
+    """エントリを従来のテキストログの1行に整形する"""
+    at = datetime.datetime.fromisoformat(entry["at"]).strftime("%Y-%m-%d %H:%M:%S")
+    label = f" ({_EVENT_LABELS[entry['type']]})" if entry["type"] in _EVENT_LABELS else ""
+    if entry["type"] == "delete" and entry.get("author") is None:
+        return f"[{at}] (削除): メッセージID {entry['id']}"
+    attachments_text = ", ".join(f"{att['filename']} ({att['url']})" for att in entry.get("attachments") or [])
+    return f"[{at}] {entry.get('author') or 'unknown'}{label}: {entry.get('content') or ''} {attachments_text}".strip()
+
+
+def attachment_info(attachment: discord.Attachment) -> dict:
+    return {
+        "id": attachment.id,
+        "filename": attachment.filename,
+        "url": attachment.url,
+        "size": attachment.size,
+        "content_type": attachment.content_type,
+    }
+
+
+# 添付ファイルを Discord の CDN から読み込む単位と、ハッシュ計算中にメモリへ保持する上限 (超えた分は一時ファイルへ)
+ATTACHMENT_CHUNK_SIZE = 64 * 1024
+ATTACHMENT_SPOOL_MEMORY = 1024 * 1024
+_archive_semaphore = None
+
+
+def blob_key(digest: str) -> str:
+    """添付ファイルの実体を保存するキー (内容の SHA-256 で決まるため、同じファイルは 1 つだけ保存される)"""
+    return f"blobs/sha256/{digest[:2]}/{digest}"
+
+
+async def archive_attachments(attachments: list) -> list:
+    """
+    添付ファイル (attachment_info() の dict) を並列 (全体で最大 ATTACHMENT_ARCHIVE_CONCURRENCY 件) で保存する。
+    CDN から一時ファイルへダウンロードしながら SHA-256 を計算し、同じ内容のブロブが既にあればアップロードしない。
+    成功した dict には "object_key" (ブロブのキー) と "sha256"、失敗した dict には "error" を設定し、
+    失敗したファイルを "ファイル名: エラー" の形式で返す。
+    """
+    global _archive_semaphore
+    if _archive_semaphore is None:
+        _archive_semaphore = asyncio.Semaphore(ATTACHMENT_ARCHIVE_CONCURRENCY)
+    errors = []
+    storage = get_storage()
+
+    async def archive(session: aiohttp.ClientSession, attachment: dict):
+        async with _archive_semaphore:
+            try:
+                with tempfile.SpooledTemporaryFile(max_size=ATTACHMENT_SPOOL_MEMORY) as spool:
+                    digest = hashlib.sha256()
+                    size = 0
+                    async with session.get(attachment["url"]) as resp:
+                        resp.raise_for_status()
+                        async for chunk in resp.content.iter_chunked(ATTACHMENT_CHUNK_SIZE):
+                            digest.update(chunk)
+                            spool.write(chunk)
+                            size += len(chunk)
+                    sha256 = digest.hexdigest()
+                    object_key = blob_key(sha256)
+                    if not await storage.object_exists(object_key):
+                        spool.seek(0)
+                        await storage.put_file(
+                            object_key, spool, size, content_type=attachment["content_type"] or "application/octet-stream"
+                        )
+                attachment.update(object_key=object_key, sha256=sha256, size=size)
+            except Exception as e:
+                attachment["error"] = str(e)
+                errors.append(f"{attachment['filename']}: {str(e)}")
+
+    if attachments:
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(archive(session, attachment) for attachment in attachments))
+    return errors
+
+
+SEGMENT_CONTENT_TYPE = "application/gzip"
+
+
+class _CaseBuffer:
+    __slots__ = ("lines", "attachments", "size", "first_at", "last_at", "last_message_id")
+
+    def __init__(self):
+        self.lines = []
+        self.attachments = []
+        self.size = 0
+        self.first_at = None
+        self.last_at = None
+        self.last_message_id = None
+
+
+class TranscriptCapture:
+    """ケースごとのログバッファと、そのセグメント書き出しを管理する。"""
+
+    def __init__(self, segment_max_bytes: int):
+        self.segment_max_bytes = segment_max_bytes
+        self._buffers = {}
+        self._locks = {}
+        self._archive_tasks = {}
+
+    def _lock(self, case_id: str) -> asyncio.Lock:
+        return self._locks.setdefault(case_id, asyncio.Lock())
+
+    def record(self, case_id: str, entry: dict) -> bool:
+        """
+        エントリをバッファに追加する。バッファが segment_max_bytes (圧縮前) を超えたら True を返す
+        (呼び出し側で flush(case_id) を行う)。
+        """
+        buffer = self._buffers.setdefault(case_id, _CaseBuffer())
+        line = json.dumps(entry, ensure_ascii=False)
+        buffer.lines.append(line)
+        buffer.size += len(line.encode("utf-8")) + 1
+        # 起動時の補完では過去のメッセージが後から届くため、期間は最小・最大で持つ
+        at = datetime.datetime.fromisoformat(entry["at"])
+        buffer.first_at = min(buffer.first_at, at) if buffer.first_at else at
+        buffer.last_at = max(buffer.last_at, at) if buffer.last_at else at
+        if entry["type"] == "message" and (buffer.last_message_id is None or entry["id"] > buffer.last_message_id):
+            buffer.last_message_id = entry["id"]
+        return buffer.size >= self.segment_max_bytes
+
+    def archive(self, case_id: str, attachments: list):
+        """
+        添付ファイルの参照を現在のセグメントに記録し、保存をバックグラウンドで開始する。
+        保存結果は、保存が終わった時点のセグメントに記録する (マニフェストでは添付ファイルIDごとにまとめる)。
+        """
+        self._buffers.setdefault(case_id, _CaseBuffer()).attachments.extend(dict(att) for att in attachments)
+
+        async def run():
+            await archive_attachments(attachments)
+            self._buffers.setdefault(case_id, _CaseBuffer()).attachments.extend(attachments)
+
+        task = asyncio.create_task(run())
+        tasks = self._archive_tasks.setdefault(case_id, set())
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def capture_message(self, case_id: str, message: discord.Message):
+        """メッセージを記録し、添付ファイルの保存を開始する。バッファが上限を超えたら書き出す。"""
+        if self.record(case_id, message_entry(message)):
+            await self.flush(case_id)
+        if message.attachments:
+            self.archive(case_id, [attachment_info(att) for att in message.attachments])
+
+    async def backfill(self, case_id: str, channel: discord.TextChannel, after: int = None) -> int:
+        """after (メッセージID) より後の履歴を記録する。after が None なら最初から。記録した件数を返す。"""
+        count = 0
+        after = discord.Object(id=after) if after else None
+        async for message in channel.history(limit=None, after=after, oldest_first=True):
+            await self.capture_message(case_id, message)
+            count += 1
+        return count
+
+    async def flush(self, case_id: str):
+        """case_id のバッファを 1 セグメント (gzip 圧縮した JSON Lines) として書き出す。"""
+        async with self._lock(case_id):
+            buffer = self._buffers.pop(case_id, None)
+            if not buffer or not (buffer.lines or buffer.attachments):
+                return
+            now = datetime.datetime.utcnow()
+            data = gzip.compress(("\n".join(buffer.lines) + "\n").encode("utf-8")) if buffer.lines else b""
+            object_key = f"ticket_logs/{case_id}/segments/{now.strftime('%Y%m%d%H%M%S%f')}.jsonl.gz"
+            try:
+                await get_storage().put_bytes(object_key, data, content_type=SEGMENT_CONTENT_TYPE)
+                await insert(
+                    "INSERT INTO transcript_segments "
+                    "(CaseId, object_key, first_at, last_at, entry_count, size_bytes, sha256, last_message_id, attachments) "
+                    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                    (case_id, object_key, buffer.first_at or now, buffer.last_at or now, len(buffer.lines), len(data),
+                     hashlib.sha256(data).hexdigest(), buffer.last_message_id, json.dumps(buffer.attachments, ensure_ascii=False))
+                )
+            except Exception:
+                # 書き出しに失敗した分は、その後に追加された行より前に戻して次回再試行する
+                pending = self._buffers.pop(case_id, None)
+                if pending:
+                    buffer.lines.extend(pending.lines)
+                    buffer.attachments.extend(pending.attachments)
+                    buffer.size += pending.size
+                    buffer.first_at = min(filter(None, (buffer.first_at, pending.first_at)), default=None)
+                    buffer.last_at = max(filter(None, (buffer.last_at, pending.last_at)), default=None)
+                    buffer.last_message_id = max(filter(None, (buffer.last_message_id, pending.last_message_id)), default=None)
+                self._buffers[case_id] = buffer
+                raise
+
+    async def flush_all(self):
+        """すべてのケースのバッファを書き出す。失敗したケースは次回に持ち越す。"""
+        for case_id in list(self._buffers):
+            try:
+                await self.flush(case_id)
+            except Exception as e:
+                print(f"❌ ログセグメントの書き出しに失敗しました (CaseID: {case_id}): {e}")
+
+    def discard(self, case_id: str):
+        self._buffers.pop(case_id, None)
+        self._locks.pop(case_id, None)
+        self._archive_tasks.pop(case_id, None)
+
+    async def seal(self, case_id: str) -> list:
+        """
+        保存中の添付ファイルを待ってから最後のセグメントを書き出し、
+        このケースの全セグメント情報を古い順に返す。
+        保存結果の記録が無い添付ファイル (保存中に Bot が停止した等) はここで保存し直し、
+        その結果を最後のセグメントの attachments に加える。
+        """
+        pending = list(self._archive_tasks.get(case_id, ()))
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        await self.flush(case_id)
+        rows = await fetch_all(
+            "SELECT object_key, first_at, last_at, entry_count, size_bytes, sha256, attachments "
+            "FROM transcript_segments WHERE CaseId = %s ORDER BY id",
+            (case_id,), dictionary=True
+        )
+        # unarchived は rows の attachments から作るため、空でなければ rows も空ではない
+        unarchived = [
+            att for att in merge_attachments(rows) if not att.get("object_key") and not att.get("error")
+        ]
+        if unarchived:
+            print(f"🔁 保存結果の無い添付ファイル {len(unarchived)} 件を保存し直します (CaseID: {case_id})")
+            await archive_attachments(unarchived)
+            # 結果を DB にも書き戻し、次回の seal() (ジョブの再試行やエクスポート時) で保存し直さないようにする
+            last = rows[-1]
+            last["attachments"] = json.dumps(json.loads(last["attachments"] or "[]") + unarchived, ensure_ascii=False)
+            await execute(
+                "UPDATE transcript_segments SET attachments = %s WHERE object_key = %s",
+                (last["attachments"], last["object_key"])
+            )
+        self.discard(case_id)
+        return rows
+
+    async def last_captured_message_ids(self) -> dict:
+        """ケースごとに、書き出し済みの最新メッセージIDを返す (起動時の取りこぼし補完用)。"""
+        rows = await fetch_all(
+            "SELECT CaseId, MAX(last_message_id) FROM transcript_segments GROUP BY CaseId"
+        )
+        return {case_id: last_id for case_id, last_id in rows}
+
+
+# --------------------------------------------------------------------------------
+# マニフェスト (インデックス) と読み出し
+# マニフェストにはセグメントごとの期間・件数・サイズを持たせ、
+# メタデータだけの参照や期間指定での取得ではセグメント全体をダウンロードしない。
+# --------------------------------------------------------------------------------
+MANIFEST_FORMAT = "jsonl-gzip-v1"
+
+
+def merge_attachments(segments: list) -> list:
+    """
+    セグメントの attachments を添付ファイルIDごとにまとめる (参照と保存結果が別のセグメントにあるため)。
+    後のセグメントの記録ほど新しく、保存結果 (object_key / error) を持つものを優先する。
+    """
+    merged = {}
+    for segment in segments:
+        for att in json.loads(segment["attachments"] or "[]"):
+            key = att.get("id") or att.get("object_key") or att.get("url")
+            current = merged.get(key)
+            if current is None or att.get("object_key") or (att.get("error") and not current.get("object_key")):
+                merged[key] = att
+    return list(merged.values())
+
+
+def build_manifest(case_id: str, segments: list) -> dict:
+    """seal() の結果からクローズ時のマニフェストを作る。"""
+    attachments = merge_attachments(segments)
+    first_at = min((segment["first_at"] for segment in segments), default=None)
+    last_at = max((segment["last_at"] for segment in segments), default=None)
+    return {
+        "case_id": case_id,
+        "format": MANIFEST_FORMAT,
+        "entries": sum(segment["entry_count"] for segment in segments),
+        "size": sum(segment["size_bytes"] for segment in segments),
+        "first_at": first_at.isoformat() if first_at else None,
+        "last_at": last_at.isoformat() if last_at else None,
+        "segments": [
+            {
+                "key": segment["object_key"],
+                "first_at": segment["first_at"].isoformat(),
+                "last_at": segment["last_at"].isoformat(),
+                "entries": segment["entry_count"],
+                "size": segment["size_bytes"],
+                "content_type": SEGMENT_CONTENT_TYPE,
+                "sha256": segment["sha256"],
+            }
+            for segment in segments
+        ],
+        "attachments": attachments,
+    }
+
+
+async def read_manifest(manifest_key: str) -> dict:
+    return json.loads(await get_storage().get_bytes(manifest_key))
+
+
+# セグメント記録より前にクローズされたチケット (ログが 1 つの .txt) のマニフェスト
+LEGACY_MANIFEST_FORMAT = "legacy-v1"
+
+
+async def build_legacy_manifest(case_id: str, log_key: str) -> dict:
+    """従来の保存形式のチケットについて、バケットを一度だけ一覧してマニフェストを作る。"""
+    log = None
+    attachments = []
+    for obj in await get_storage().list_objects(f"ticket_logs/{case_id}_", recursive=True):
+        info = {
+            "object_key": obj.object_name,
+            "size": obj.size,
+            "etag": obj.etag,
+        }
+        if obj.object_name == log_key:
+            log = dict(info, key=info.pop("object_key"), content_type="text/plain")
+        else:
+            filename = obj.object_name.split("/")[-1]
+            attachments.append(dict(info, filename=filename, content_type=mimetypes.guess_type(filename)[0]))
+    return {
+        "case_id": case_id,
+        "format": LEGACY_MANIFEST_FORMAT,
+        "log": log or {"key": log_key},
+        "attachments": attachments,
+    }
+
+
+async def load_case_manifest(ticket: dict) -> dict:
+    """
+    チケットのマニフェストを返す。tickets.manifest_key が未設定のチケットは、
+    その場でマニフェストを用意してキーを保存する (以降の取得では一覧が不要になる)。
+    """
+    if ticket.get("manifest_key"):
+        return await read_manifest(ticket["manifest_key"])
+
+    s3_filepath = ticket["s3_filepath"]
+    if s3_filepath.endswith(".manifest.json"):
+        manifest_key = s3_filepath
+        manifest = await read_manifest(manifest_key)
+    else:
+        manifest_key = f"ticket_logs/{ticket['CaseId']}/manifest.json"
+        manifest = await build_legacy_manifest(ticket["CaseId"], s3_filepath)
+        await get_storage().put_bytes(
+            manifest_key, json.dumps(manifest, ensure_ascii=False).encode("utf-8"), content_type="application/json"
+        )
+    await execute("UPDATE tickets SET manifest_key = %s WHERE id = %s", (manifest_key, ticket["id"]))
+    return manifest
+
+
+def _parse_segment(data: bytes) -> list:
+    lines = gzip.decompress(data).decode("utf-8").splitlines()
+    return [json.loads(line) for line in lines if line]
+
+
+def ordered_entries(entries: list) -> list:
+    """
+    重複を除き、時刻 (同時刻ならメッセージID) の順に並べる。
+    起動時の補完とリアルタイム記録が重なると同じメッセージが 2 回、また時刻の前後した順で記録されるため。
+    """
+    unique = {}
+    for entry in entries:
+        unique.setdefault((entry["type"], entry["id"], entry["at"]), entry)
+    return sorted(unique.values(), key=lambda entry: (entry["at"], entry["id"]))
+
+
+async def read_entries(manifest: dict, since: datetime.datetime = None, until: datetime.datetime = None) -> list:
+    """
+    マニフェストの期間情報から該当するセグメントだけを取得し、重複を除いて時刻順にしたエントリを返す。
+    since / until (naive UTC) を指定すると、その期間 (since 以上 until 未満) のエントリに絞り込む。
+    """
+    segments = [
+        segment for segment in manifest["segments"]
+        if (since is None or datetime.datetime.fromisoformat(segment["last_at"]) >= since)
+        and (until is None or datetime.datetime.fromisoformat(segment["first_at"]) < until)
+    ]
+    storage = get_storage()
+    blobs = await asyncio.gather(*(storage.get_bytes(segment["key"]) for segment in segments))
+    entries = []
+    for segment, data in zip(segments, blobs):
+        for entry in _parse_segment(data):
+            at = datetime.datetime.fromisoformat(entry["at"])
+            if (since and at < since) or (until and at >= until):
+                continue
+            entries.append(entry)
+    return ordered_entries(entries)
+
+
+def render_transcript(entries: list) -> bytes:
+    """エントリを従来のテキストログ (.txt) 形式に整形する"""
+    return "\n".join(render_entry(entry) for entry in ordered_entries(entries)).encode("utf-8")
+
+
+async def read_manifest_log(manifest_key: str, since: datetime.datetime = None, until: datetime.datetime = None) -> bytes:
+    """マニフェスト形式のログを、従来のテキストログとして返す。"""
+    return render_transcript(await read_entries(await read_manifest(manifest_key), since, until))
+
+
+_capture = None
+
+
+def get_capture() -> TranscriptCapture:
+    global _capture
+    if _capture is None:
+        _capture = TranscriptCapture(segment_max_bytes=TRANSCRIPT_SEGMENT_MAX_BYTES)
+    return _capture
@@ -0,0 +1,90 @@
+# ttl_cache.py (有効期限付きの LRU キャッシュ)
+#
+# 外部 API の結果など「めったに変わらないが毎回取りに行くと遅い / レート制限される」値を
+# メモリ上に保持する。件数 (max_entries) と合計サイズ (max_bytes) のどちらか、または両方で上限を設け、
+# 超えた分は最後に使われたのが古いものから捨てる。ヒット / ミスの回数は stats() で確認できる。
+
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    _MISSING = object()
+
+    def __init__(self, ttl: float, max_entries: int = 0, max_bytes: int = 0, sizeof=None):
+        """
+        ttl: 既定の有効期間 (秒)。set() で値ごとに上書きできる
+        max_entries / max_bytes: 件数 / 合計サイズの上限 (0 なら上限なし)
+        sizeof(value): max_bytes を使う場合の値のサイズ (省略時は len())
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or len
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        # key -> (期限, サイズ, 値)。並び順が最終利用順 (末尾が最新)
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """有効期限内の値を返す。無い / 期限切れなら default を返す。"""
+        entry = self._entries.get(key, self._MISSING)
+        if entry is not self._MISSING:
+            expires_at, _, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self._remove(key)
+        self.misses += 1
+        return default
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        size = self.sizeof(value) if self.max_bytes else 0
+        if self.max_bytes and size > self.max_bytes:
+            # 単体で上限を超える値はキャッシュしない
+            return
+        self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, size, value)
+        self.total_bytes += size
+        self._evict()
+
+    def invalidate(self, key):
+        self._remove(key)
+
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+
+    def _evict(self):
+        while self._entries and (
+            (self.max_entries and len(self._entries) > self.max_entries)
+            or (self.max_bytes and self.total_bytes > self.max_bytes)
+        ):
+            _, (_, size, _) = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }